@@ -3,82 +3,528 @@
 Simple API proxy to handle Together AI requests and avoid CORS issues
 """
 
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
 import requests
+from prometheus_client import Counter, Gauge, Histogram, make_wsgi_app
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 import os
 import json
+import re
+import time
+import gzip
+import socket
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import wraps
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+from config import RATE_LIMIT_TIERS, CONFIG_JSON_BYTES, CONFIG_ETAG, get_model_spec
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for jsonify() and request.get_json()"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json'
+        )
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+app.json = OrjsonProvider(app)
+# Oversized bodies are rejected with a 413 before they are read or parsed
+app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
+
+# Constant CORS headers for the local UI; preflights are answered before routing
+_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Authorization, Content-Type',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Max-Age': '86400'
+}
+
+@app.before_request
+def _preflight():
+    if request.method == 'OPTIONS':
+        return Response(status=204, headers=_CORS_HEADERS)
+
+@app.after_request
+def _cors(response):
+    response.headers.update(_CORS_HEADERS)
+    return response
+
+TOGETHER_API_BASE = 'https://api.together.xyz'
+
+# Shared upstream session so proxied calls reuse pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake to Together AI on every request.
+# Size the pool to the number of concurrent in-flight calls per worker.
+UPSTREAM_POOL_SIZE = int(os.getenv('TOGETHER_AI_PROXY_POOL_SIZE', '50'))
+
+# Probe idle sockets every 10s after 30s of silence so upstream load balancers don't
+# drop them between bursts; these options are platform specific, so set what exists
+_KEEPALIVE_OPTIONS = [
+    (socket.IPPROTO_TCP, getattr(socket, name), value)
+    for name, value in (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+    if hasattr(socket, name)
+]
+
+class KeepaliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP_NODELAY and tuned TCP keepalive on upstream sockets"""
+    
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ] + _KEEPALIVE_OPTIONS
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+SESSION = requests.Session()
+_adapter = KeepaliveAdapter(
+    pool_connections=UPSTREAM_POOL_SIZE,
+    pool_maxsize=UPSTREAM_POOL_SIZE,
+    # Idempotent calls are retried on throttling/unavailability, waiting out any
+    # Retry-After the upstream sends; POST inference calls are never replayed
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        respect_retry_after_header=True,
+        # Once retries run out, hand back the last upstream response so its status
+        # and body reach the caller (and the breaker) instead of a RetryError
+        raise_on_status=False
+    ),
+    pool_block=False
+)
+SESSION.mount("https://", _adapter)
+
+class TokenBucket:
+    """Thread-safe token bucket that blocks callers until a request token is available"""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping outside the lock until the bucket refills"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Smooth bursts below the deployed tier's RPS so upstream 429s become short
+# inline waits; tiers with custom limits (e.g. scale) are not throttled. The tier
+# limit applies per API key, so each key gets its own bucket, and every worker
+# process holds its own buckets, so each gets an equal share of the rate. A single
+# process (the dev server) keeps the whole rate; gunicorn reports its worker count.
+RATE_LIMIT_TIER = os.getenv('TOGETHER_AI_RATE_LIMIT_TIER', 'build_tier_2')
+_tier_rps = RATE_LIMIT_TIERS.get(RATE_LIMIT_TIER, {}).get('rps')
+LIMITERS_MAXSIZE = 1024
+LIMITER_RATE = None
+
+_limiters = {}  # sha256(api_key) -> TokenBucket
+_limiters_lock = threading.Lock()
+
+def set_worker_count(workers):
+    """Split the tier's RPS evenly across this many worker processes"""
+    global LIMITER_RATE
+    LIMITER_RATE = _tier_rps / max(1, workers) if isinstance(_tier_rps, (int, float)) else None
+    with _limiters_lock:
+        _limiters.clear()
+
+set_worker_count(1)
+
+def _limiter_for(api_key):
+    """The token bucket for api_key, or None when requests aren't throttled"""
+    if LIMITER_RATE is None or not api_key:
+        return None
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    with _limiters_lock:
+        bucket = _limiters.get(key)
+        if bucket is None:
+            if len(_limiters) >= LIMITERS_MAXSIZE:
+                # Dicts keep insertion order, so this drops the longest-held bucket
+                _limiters.pop(next(iter(_limiters)))
+            bucket = _limiters[key] = TokenBucket(LIMITER_RATE)
+        return bucket
+
+class CircuitBreaker:
+    """Fails fast after consecutive upstream failures until a cool-off window has passed
+    
+    After the cool-off the breaker is half-open: exactly one probe call goes upstream
+    while everyone else keeps failing fast, and its outcome closes or re-opens it.
+    """
+    
+    def __init__(self, fail_max=5, reset_timeout=30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self.lock = threading.Lock()
+    
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+    
+    def allow(self):
+        """Return whether a call may go upstream; after the cool-off only one probe is let through"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if self.probe_started_at is not None:
+                # A probe that never reported back (e.g. its worker died) is replaced
+                # once it has had a full cool-off window to finish
+                if now - self.probe_started_at < self.reset_timeout:
+                    return False
+            elif now - self.opened_at < self.reset_timeout:
+                return False
+            self.probe_started_at = now
+            return True
+    
+    def record_success(self):
+        with self.lock:
+            self.failure_count = 0
+            self.opened_at = None
+            self.probe_started_at = None
+    
+    def record_failure(self):
+        with self.lock:
+            self.failure_count += 1
+            if self.probe_started_at is not None:
+                # The half-open probe failed: stay open for another full cool-off
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+                print("Circuit breaker probe failed; staying open")
+            elif self.failure_count >= self.fail_max and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                print(f"Circuit breaker opened after {self.failure_count} upstream failures")
+
+BREAKER = CircuitBreaker(
+    fail_max=int(os.getenv('TOGETHER_AI_BREAKER_FAIL_MAX', '5')),
+    reset_timeout=int(os.getenv('TOGETHER_AI_BREAKER_RESET_TIMEOUT', '30'))
+)
+
+ERROR_SNIPPET_BYTES = 512
+
+# Identical non-streaming inference payloads from the same API key that arrive while
+# one is already in flight wait on that call's result instead of going upstream again
+_inflight = {}  # blake2b(api_key + payload) -> Future of (body, status, content_type)
+_inflight_lock = threading.Lock()
+
+# Metrics are created once here; handlers only look up label children and observe
+REQ_LATENCY = Histogram(
+    'proxy_latency_seconds', 'Time to respond to proxied Together AI calls',
+    ['endpoint', 'status'],
+    buckets=(.05, .1, .25, .5, 1, 2, 5, 10, 30, 60)
+)
+ERRORS = Counter('proxy_errors_total', 'Proxied calls answered with an error status', ['endpoint', 'status'])
+COALESCED = Counter('proxy_coalesced_requests_total', 'Inference requests served by an identical in-flight call')
+BREAKER_OPEN = Gauge('proxy_circuit_breaker_open', 'Whether the upstream circuit breaker is open')
+BREAKER_OPEN.set_function(lambda: int(BREAKER.is_open))
+
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/metrics': make_wsgi_app()})
+
+def _observed(endpoint):
+    """Record latency and error metrics for a proxy handler"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = app.make_response(func(*args, **kwargs))
+                status = response.status_code
+                return response
+            finally:
+                REQ_LATENCY.labels(endpoint, status).observe(time.perf_counter() - start)
+                if status >= 400:
+                    ERRORS.labels(endpoint, status).inc()
+        return wrapper
+    return decorator
+
+# Per-API-key cache of the models catalog; entries are kept past expiry so
+# they can be revalidated with If-None-Match when Together AI sends an ETag
+MODELS_CACHE_TTL = int(os.getenv('TOGETHER_AI_MODELS_CACHE_TTL', '120'))
+MODELS_CACHE_MAXSIZE = 1024
+_models_cache = {}  # sha256(api_key) -> (expires_at, etag, raw body bytes)
+_models_cache_lock = threading.Lock()
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+# ui.html is read and gzip-compressed once at startup; each variant gets its own ETag
+with open(os.path.join(app.root_path, 'ui.html'), 'rb') as f:
+    UI_HTML = f.read()
+UI_HTML_GZ = gzip.compress(UI_HTML, 9)
+UI_ETAG = f'"{hashlib.md5(UI_HTML, usedforsecurity=False).hexdigest()}"'
+UI_ETAG_GZ = UI_ETAG[:-1] + '-gz"'
 
 @app.route('/')
 def index():
-    return send_from_directory('.', 'ui.html')
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = UI_ETAG_GZ if use_gzip else UI_ETAG
+    # no-cache lets browsers keep the page but revalidate it, answered with a bodyless 304
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(UI_HTML_GZ, mimetype='text/html', headers=headers)
+    return Response(UI_HTML, mimetype='text/html', headers=headers)
 
-@app.route('/api/models', methods=['GET'])
-def get_models():
-    """Proxy for Together AI models endpoint"""
-    api_key = request.headers.get('Authorization')
-    if not api_key:
-        return jsonify({'error': 'No API key provided'}), 401
+@app.route('/api/config', methods=['GET'])
+def get_config():
+    """Serve the prebuilt troubleshooting config payload"""
+    headers = {'Cache-Control': 'public, max-age=300', 'ETag': CONFIG_ETAG}
+    if CONFIG_ETAG in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(CONFIG_JSON_BYTES, mimetype='application/json', headers=headers)
+
+def _store_models(cache_key, response, body, etag=None):
+    """Cache a models catalog, honoring upstream Cache-Control directives"""
+    cache_control = response.headers.get('Cache-Control', '')
+    if 'no-store' in cache_control:
+        return
+    
+    ttl = MODELS_CACHE_TTL
+    max_age = _MAX_AGE_RE.search(cache_control)
+    if max_age:
+        ttl = min(ttl, int(max_age.group(1)))
+    
+    with _models_cache_lock:
+        if cache_key not in _models_cache and len(_models_cache) >= MODELS_CACHE_MAXSIZE:
+            # Evict the oldest entry; dicts preserve insertion order
+            _models_cache.pop(next(iter(_models_cache)))
+        _models_cache[cache_key] = (time.monotonic() + ttl, response.headers.get('ETag', etag), body)
+
+def _forward(method, path, failure_label, on_success=None, success_codes=(200,), **kwargs):
+    """Send a request to Together AI and translate the outcome into a proxy response"""
+    if not BREAKER.allow():
+        return jsonify({'error': 'Upstream temporarily unavailable (circuit open)'}), 503
     
     try:
-        response = requests.get(
-            'https://api.together.xyz/v1/models',
-            headers={'Authorization': api_key},
-            timeout=30
-        )
+        limiter = _limiter_for(kwargs.get('headers', {}).get('Authorization'))
+        if limiter:
+            limiter.acquire()
+        response = SESSION.request(method, f'{TOGETHER_API_BASE}{path}', stream=True, **kwargs)
+        
+        if response.status_code >= 500:
+            BREAKER.record_failure()
+        else:
+            BREAKER.record_success()
         
-        if response.status_code == 200:
-            return jsonify(response.json())
+        if response.status_code in success_codes:
+            if on_success:
+                return on_success(response)
+            # Forward the upstream body as-is rather than parsing and re-serializing it;
+            # this also passes text/event-stream completions through unbuffered
+            proxied = Response(
+                response.iter_content(chunk_size=64 * 1024),
+                status=response.status_code,
+                content_type=response.headers.get('Content-Type', 'application/json')
+            )
+            proxied.call_on_close(response.close)
+            return proxied
         else:
+            # Only read a bounded prefix so huge upstream error pages are never downloaded in full
+            snippet = response.raw.read(ERROR_SNIPPET_BYTES, decode_content=True)
+            response.close()
             return jsonify({
-                'error': f'API request failed with status {response.status_code}',
+                'error': f'{failure_label} failed with status {response.status_code}',
                 'status_code': response.status_code,
-                'response': response.text[:500]
+                'response': snippet.decode(response.encoding or 'utf-8', errors='replace')[:500]
             }), response.status_code
             
     except requests.exceptions.Timeout:
+        BREAKER.record_failure()
         return jsonify({'error': 'Request timed out'}), 408
     except requests.exceptions.ConnectionError:
+        BREAKER.record_failure()
         return jsonify({'error': 'Connection error'}), 503
     except Exception as e:
+        # Every admitted call must report an outcome, or a half-open probe would never resolve
+        BREAKER.record_failure()
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/api/models', methods=['GET'])
+@_observed('models')
+def get_models():
+    """Proxy for Together AI models endpoint"""
+    api_key = request.headers.get('Authorization')
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 401
+    
+    cache_key = hashlib.sha256(api_key.encode()).hexdigest()
+    with _models_cache_lock:
+        cached = _models_cache.get(cache_key)
+    
+    if cached and cached[0] > time.monotonic():
+        return Response(cached[2], mimetype='application/json')
+    
+    headers = {'Authorization': api_key}
+    if cached and cached[1]:
+        headers['If-None-Match'] = cached[1]
+    
+    def store(response):
+        if response.status_code == 304:
+            response.close()
+            _store_models(cache_key, response, cached[2], etag=cached[1])
+            return Response(cached[2], mimetype='application/json')
+        body = response.content
+        _store_models(cache_key, response, body)
+        return Response(body, mimetype='application/json')
+    
+    return _forward(
+        'GET', '/v1/models', 'API request',
+        on_success=store,
+        success_codes=(200, 304) if cached else (200,),
+        headers=headers,
+        timeout=30
+    )
+
+def _validate_inference_payload(payload):
+    """Return a list of problems with an inference payload, empty when it can be forwarded"""
+    if not isinstance(payload, dict):
+        return ['Request body must be a JSON object']
+    
+    errors = []
+    model = payload.get('model')
+    if not isinstance(model, str) or not model:
+        errors.append('model must be a non-empty string')
+    
+    prompt = payload.get('prompt')
+    messages = payload.get('messages')
+    if prompt is None and messages is None:
+        errors.append('prompt or messages is required')
+    if prompt is not None and not isinstance(prompt, str):
+        errors.append('prompt must be a string')
+    if messages is not None and not (
+        isinstance(messages, list) and all(isinstance(m, dict) for m in messages)
+    ):
+        errors.append('messages must be a list of objects')
+    
+    max_tokens = payload.get('max_tokens')
+    if max_tokens is not None:
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+            errors.append('max_tokens must be a positive integer')
+        elif isinstance(model, str):
+            spec = get_model_spec(model)
+            if spec and 'context_length' in spec and max_tokens > spec['context_length']:
+                errors.append(f"max_tokens exceeds the {spec['context_length']} token context of {model}")
+    
+    temperature = payload.get('temperature')
+    if temperature is not None and (
+        isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or temperature < 0
+    ):
+        errors.append('temperature must be a non-negative number')
+    
+    return errors
+
 @app.route('/api/inference', methods=['POST'])
+@_observed('inference')
 def inference():
     """Proxy for Together AI inference endpoint"""
     api_key = request.headers.get('Authorization')
     if not api_key:
         return jsonify({'error': 'No API key provided'}), 401
     
+    raw = request.get_data(cache=False)
     try:
-        payload = request.get_json()
-        response = requests.post(
-            'https://api.together.xyz/inference',
-            headers={'Authorization': api_key, 'Content-Type': 'application/json'},
-            json=payload,
-            timeout=60
-        )
-        
-        if response.status_code == 200:
-            return jsonify(response.json())
+        payload = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return jsonify({'error': 'Request body is not valid JSON'}), 400
+    
+    errors = _validate_inference_payload(payload)
+    if errors:
+        return jsonify({'error': 'Invalid inference payload', 'details': errors}), 400
+    
+    forward_kwargs = {
+        'headers': {'Authorization': api_key, 'Content-Type': 'application/json'},
+        # The validated body is forwarded byte-for-byte instead of being re-encoded
+        'data': raw,
+        'timeout': 60
+    }
+    
+    # Streamed completions can't be shared between clients, so they always go upstream
+    if isinstance(payload, dict) and payload.get('stream'):
+        return _forward('POST', '/inference', 'Inference request', **forward_kwargs)
+    
+    return _coalesced_inference(api_key, payload, forward_kwargs)
+
+def _coalesced_inference(api_key, payload, forward_kwargs):
+    """Forward an inference call, sharing the result with identical concurrent callers"""
+    key = hashlib.blake2b(
+        api_key.encode() + orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    ).digest()
+    
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight[key] = Future()
         else:
-            return jsonify({
-                'error': f'Inference request failed with status {response.status_code}',
-                'status_code': response.status_code,
-                'response': response.text[:500]
-            }), response.status_code
-            
-    except requests.exceptions.Timeout:
-        return jsonify({'error': 'Request timed out'}), 408
-    except requests.exceptions.ConnectionError:
-        return jsonify({'error': 'Connection error'}), 503
+            COALESCED.inc()
+    
+    if not is_leader:
+        try:
+            body, status, content_type = future.result(timeout=forward_kwargs['timeout'])
+        except FutureTimeoutError:
+            return jsonify({'error': 'Request timed out'}), 408
+        return Response(body, status=status, content_type=content_type)
+    
+    try:
+        response = app.make_response(_forward(
+            'POST', '/inference', 'Inference request',
+            on_success=lambda r: Response(
+                r.content,
+                status=r.status_code,
+                content_type=r.headers.get('Content-Type', 'application/json')
+            ),
+            **forward_kwargs
+        ))
+        future.set_result((response.get_data(), response.status_code, response.content_type))
+        return response
     except Exception as e:
-        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def warm_upstream():
+    """Open a pooled TLS connection to Together AI so the first proxied call skips the handshake"""
+    headers = {}
+    warmup_key = os.getenv('TOGETHER_WARMUP_KEY')
+    if warmup_key:
+        headers['Authorization'] = f'Bearer {warmup_key}'
+    try:
+        # Any response (even a 401 without a key) leaves a keep-alive socket in the pool
+        SESSION.get(f'{TOGETHER_API_BASE}/v1/models', headers=headers, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"Upstream warm-up failed: {e}")
 
 if __name__ == '__main__':
     print("Starting Together AI Troubleshooting Tool API Proxy...")
+    warm_upstream()
     print("Access the UI at: http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
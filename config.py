@@ -3,98 +3,143 @@ Configuration file for Together AI troubleshooting scenarios
 Contains error codes, common issues, and automated diagnostic rules
 """
 
+import sys
+import json
+import types
+import hashlib
+import functools
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+
+@dataclass(frozen=True, slots=True)
+class ErrorInfo:
+    """Reference information for an HTTP status code returned by Together AI"""
+    name: str
+    common_causes: Tuple[str, ...]
+    solutions: Tuple[str, ...]
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "common_causes": list(self.common_causes),
+            "solutions": list(self.solutions)
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class DiagnosticRule:
+    """A troubleshooting rule; match is the compiled form of the condition string"""
+    condition: str
+    status_code: Optional[int]  # status code the rule is restricted to, None for any
+    match: Callable[[dict], bool] = field(compare=False, repr=False)
+    priority: str
+    category: str
+    message: str
+    actions: Tuple[str, ...]
+
+    def to_dict(self):
+        return {
+            "condition": self.condition,
+            "priority": self.priority,
+            "category": self.category,
+            "message": self.message,
+            "actions": list(self.actions)
+        }
+
 # Error code mappings from Together AI documentation
 ERROR_CODES = {
-    400: {
-        "name": "Bad Request",
-        "common_causes": [
+    400: ErrorInfo(
+        name="Bad Request",
+        common_causes=(
             "Invalid request format",
             "Missing required parameters (model, prompt)",
             "Invalid model name",
             "max_tokens exceeds model limit",
             "Invalid parameter values"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Validate request payload format",
             "Check model name against /models endpoint",
-            "Reduce max_tokens parameter", 
+            "Reduce max_tokens parameter",
             "Ensure all required fields are present",
             "Verify parameter data types"
-        ]
-    },
-    401: {
-        "name": "Unauthorized",
-        "common_causes": [
+        )
+    ),
+    401: ErrorInfo(
+        name="Unauthorized",
+        common_causes=(
             "Invalid API key",
             "Missing Authorization header",
             "Expired API key",
             "Incorrect header format"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Verify API key at api.together.ai",
             "Use format: 'Authorization: Bearer YOUR_API_KEY'",
             "Regenerate API key if needed",
             "Check API key permissions"
-        ]
-    },
-    404: {
-        "name": "Not Found",
-        "common_causes": [
+        )
+    ),
+    404: ErrorInfo(
+        name="Not Found",
+        common_causes=(
             "Invalid endpoint URL",
             "Model not available",
             "Incorrect API version"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Check endpoint URL spelling",
             "Verify model exists in /models list",
             "Use correct base URL: https://api.together.xyz"
-        ]
-    },
-    429: {
-        "name": "Rate Limit Exceeded",
-        "common_causes": [
+        )
+    ),
+    429: ErrorInfo(
+        name="Rate Limit Exceeded",
+        common_causes=(
             "Too many requests per second (RPS)",
-            "Too many tokens per second (TPS)", 
+            "Too many tokens per second (TPS)",
             "Burst traffic patterns",
             "Insufficient rate limit tier"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Implement exponential backoff",
             "Add request queuing",
             "Monitor rate limit headers",
             "Request higher limits",
             "Upgrade to Scale/Enterprise tier"
-        ]
-    },
-    500: {
-        "name": "Internal Server Error",
-        "common_causes": [
+        )
+    ),
+    500: ErrorInfo(
+        name="Internal Server Error",
+        common_causes=(
             "Server-side processing error",
             "Model inference failure",
             "Temporary system issues"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Retry request after delay",
             "Check Together AI status page",
             "Try different model",
             "Contact support if persistent"
-        ]
-    },
-    503: {
-        "name": "Service Unavailable", 
-        "common_causes": [
+        )
+    ),
+    503: ErrorInfo(
+        name="Service Unavailable",
+        common_causes=(
             "Server overload",
             "Scheduled maintenance",
             "Capacity issues",
             "Regional outages"
-        ],
-        "solutions": [
+        ),
+        solutions=(
             "Check status.together.ai",
             "Implement retry with backoff",
             "Switch to dedicated instances",
             "Use different region if available"
-        ]
-    }
+        )
+    )
 }
 
 # Rate limit tiers and thresholds
@@ -191,91 +236,124 @@ PERFORMANCE_THRESHOLDS = {
 }
 
 # Troubleshooting decision tree
-DIAGNOSTIC_RULES = [
-    {
-        "condition": "status_code == 503",
-        "priority": "high",
-        "category": "availability",
-        "message": "Service unavailable - likely capacity or maintenance issue",
-        "actions": [
-            "Check status.together.ai for incidents", 
+DIAGNOSTIC_RULES = (
+    DiagnosticRule(
+        condition="status_code == 503",
+        status_code=503,
+        match=lambda ctx: True,
+        priority="high",
+        category="availability",
+        message="Service unavailable - likely capacity or maintenance issue",
+        actions=(
+            "Check status.together.ai for incidents",
             "Implement retry with exponential backoff",
             "Consider dedicated instances for guaranteed capacity"
-        ]
-    },
-    {
-        "condition": "status_code == 429 and 'rate limit' in error_message",
-        "priority": "high", 
-        "category": "rate_limiting",
-        "message": "Rate limit exceeded - need to reduce request frequency",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="status_code == 429 and 'rate limit' in error_message",
+        status_code=429,
+        match=lambda ctx: 'rate limit' in ctx.get('error_message', ''),
+        priority="high",
+        category="rate_limiting",
+        message="Rate limit exceeded - need to reduce request frequency",
+        actions=(
             "Check current rate limit in Settings > Billing",
             "Implement request queuing",
             "Request rate limit increase if justified",
             "Add exponential backoff"
-        ]
-    },
-    {
-        "condition": "status_code == 401",
-        "priority": "high",
-        "category": "authentication", 
-        "message": "Authentication failure - API key issue",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="status_code == 401",
+        status_code=401,
+        match=lambda ctx: True,
+        priority="high",
+        category="authentication",
+        message="Authentication failure - API key issue",
+        actions=(
             "Verify API key format and validity",
             "Check Authorization header format",
             "Regenerate API key if compromised",
             "Ensure API key has required permissions"
-        ]
-    },
-    {
-        "condition": "response_time_ms > 10000",
-        "priority": "medium",
-        "category": "performance",
-        "message": "High latency detected - performance issue",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="response_time_ms > 10000",
+        status_code=None,
+        match=lambda ctx: ctx.get('response_time_ms', 0) > 10000,
+        priority="medium",
+        category="performance",
+        message="High latency detected - performance issue",
+        actions=(
             "Try smaller/faster model",
             "Check system load and capacity",
             "Optimize prompt length and complexity",
             "Consider dedicated instances"
-        ]
-    },
-    {
-        "condition": "status_code == 400 and 'model' in error_message",
-        "priority": "medium",
-        "category": "configuration",
-        "message": "Invalid model specification",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="status_code == 400 and 'model' in error_message",
+        status_code=400,
+        match=lambda ctx: 'model' in ctx.get('error_message', ''),
+        priority="medium",
+        category="configuration",
+        message="Invalid model specification",
+        actions=(
             "Check model name against /models endpoint",
             "Verify model is available in your tier",
             "Check spelling and case sensitivity",
             "Try alternative similar model"
-        ]
-    },
-    {
-        "condition": "status_code == 400 and 'max_tokens' in error_message", 
-        "priority": "medium",
-        "category": "configuration",
-        "message": "Token limit exceeded for model",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="status_code == 400 and 'max_tokens' in error_message",
+        status_code=400,
+        match=lambda ctx: 'max_tokens' in ctx.get('error_message', ''),
+        priority="medium",
+        category="configuration",
+        message="Token limit exceeded for model",
+        actions=(
             "Reduce max_tokens parameter",
             "Check model's context length limit",
             "Split request into smaller chunks",
             "Use model with higher token limit"
-        ]
-    },
-    {
-        "condition": "connection_timeout",
-        "priority": "medium",
-        "category": "connectivity",
-        "message": "Network connectivity issue",
-        "actions": [
+        )
+    ),
+    DiagnosticRule(
+        condition="connection_timeout",
+        status_code=None,
+        match=lambda ctx: bool(ctx.get('connection_timeout')),
+        priority="medium",
+        category="connectivity",
+        message="Network connectivity issue",
+        actions=(
             "Check internet connection",
             "Verify firewall settings",
             "Test with different network",
             "Increase client timeout values"
-        ]
-    }
-]
+        )
+    )
+)
+
+# Rules bucketed by status code so matching is a dict lookup instead of a full scan
+RULES_BY_STATUS = defaultdict(list)
+STATUS_AGNOSTIC_RULES = []
+for _rule in DIAGNOSTIC_RULES:
+    if _rule.status_code is None:
+        STATUS_AGNOSTIC_RULES.append(_rule)
+    else:
+        RULES_BY_STATUS[_rule.status_code].append(_rule)
+RULES_BY_STATUS = dict(RULES_BY_STATUS)
+
+
+def match_diagnostic_rules(ctx):
+    """Return the diagnostic rules whose condition holds for a context dict
+
+    ctx may contain status_code, error_message, response_time_ms and connection_timeout.
+    """
+    candidates = RULES_BY_STATUS.get(ctx.get('status_code'), ()) + STATUS_AGNOSTIC_RULES
+    return [rule for rule in candidates if rule.match(ctx)]
 
 # Customer issue patterns and responses
 CUSTOMER_ISSUE_PATTERNS = {
@@ -496,4 +574,74 @@ RESOURCES = {
     "billing_page": "https://api.together.ai/settings/billing",
     "api_keys": "https://api.together.ai/settings/api-keys",
     "models_endpoint": "https://api.together.xyz/models"
-}
\ No newline at end of file
+}
+
+
+def _freeze(obj):
+    """Recursively convert dicts to read-only mappings and lists to tuples, interning str keys"""
+    if isinstance(obj, dict):
+        return types.MappingProxyType({
+            sys.intern(k) if isinstance(k, str) else k: _freeze(v) for k, v in obj.items()
+        })
+    if isinstance(obj, list):
+        return tuple(_freeze(item) for item in obj)
+    return obj
+
+
+# Freeze the constants so they are immutable, compact, and safe to share between
+# forked workers (copy-on-write pages stay shared when nothing writes to them)
+ERROR_CODES = _freeze(ERROR_CODES)
+RATE_LIMIT_TIERS = _freeze(RATE_LIMIT_TIERS)
+POPULAR_MODELS = _freeze(POPULAR_MODELS)
+EMBEDDING_MODELS = _freeze(EMBEDDING_MODELS)
+PERFORMANCE_THRESHOLDS = _freeze(PERFORMANCE_THRESHOLDS)
+DIAGNOSTIC_RULES = _freeze(DIAGNOSTIC_RULES)
+RULES_BY_STATUS = _freeze(RULES_BY_STATUS)
+STATUS_AGNOSTIC_RULES = _freeze(STATUS_AGNOSTIC_RULES)
+CUSTOMER_ISSUE_PATTERNS = _freeze(CUSTOMER_ISSUE_PATTERNS)
+MONITORING_RECOMMENDATIONS = _freeze(MONITORING_RECOMMENDATIONS)
+BEST_PRACTICES = _freeze(BEST_PRACTICES)
+DIAGNOSTIC_QUESTIONS = _freeze(DIAGNOSTIC_QUESTIONS)
+RESOURCES = _freeze(RESOURCES)
+
+def _json_default(obj):
+    """Serialize frozen mappings and config dataclasses for the config payload"""
+    if isinstance(obj, types.MappingProxyType):
+        return dict(obj)
+    if isinstance(obj, (ErrorInfo, DiagnosticRule)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# Config payload served to the UI, serialized once at import so requests only copy bytes
+CONFIG_JSON_BYTES = json.dumps({
+    'error_codes': ERROR_CODES,
+    'models': POPULAR_MODELS,
+    'rules': DIAGNOSTIC_RULES,
+    'tiers': RATE_LIMIT_TIERS,
+    'resources': RESOURCES
+}, default=_json_default, separators=(',', ':')).encode()
+CONFIG_ETAG = f'"{hashlib.md5(CONFIG_JSON_BYTES, usedforsecurity=False).hexdigest()}"'
+
+
+@functools.lru_cache(maxsize=64)
+def get_error_info(status_code):
+    """Return the ErrorInfo for an HTTP status code, or None if unknown"""
+    return ERROR_CODES.get(status_code)
+
+
+@functools.lru_cache(maxsize=256)
+def get_model_spec(model_name):
+    """Return the read-only spec for a known chat or embedding model, or None"""
+    return POPULAR_MODELS.get(model_name) or EMBEDDING_MODELS.get(model_name)
+
+
+@functools.lru_cache(maxsize=256)
+def diagnose(status_code=None, error_message='', response_time_ms=0, connection_timeout=False):
+    """Return the tuple of compiled diagnostic rules matching an observed failure"""
+    return tuple(match_diagnostic_rules({
+        'status_code': status_code,
+        'error_message': error_message,
+        'response_time_ms': response_time_ms,
+        'connection_timeout': connection_timeout
+    }))
@@ -0,0 +1,23 @@
+"""
+Gunicorn settings for the Together AI API proxy
+
+Run with: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+bind = os.getenv('TOGETHER_AI_PROXY_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('TOGETHER_AI_PROXY_WORKERS', '4'))
+worker_class = 'gevent'
+worker_connections = int(os.getenv('TOGETHER_AI_PROXY_WORKER_CONNECTIONS', '1000'))
+
+# Import the app once in the master so forked workers share the frozen config pages
+preload_app = True
+
+
+def post_worker_init(worker):
+    """Size each worker's share of the rate limit and warm its upstream pool after the fork"""
+    from api_proxy import set_worker_count, warm_upstream
+    # The effective worker count, including any -w given on the command line
+    set_worker_count(worker.cfg.workers)
+    warm_upstream()
@@ -7,23 +7,144 @@ including rate limits, API errors, model availability, and performance issues.
 """
 
 import json
+import sys
 import time
-import requests
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+import argparse
+from typing import Dict, List, Optional, Tuple, Union, get_args, get_origin
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timedelta
-import statistics
+import math
 import logging
+import logging.handlers
 import os
+import re
+import types
+import copy
+import hashlib
+import tempfile
+import gzip
+import zlib
+import sqlite3
+import threading
 import asyncio
 import aiohttp
-from functools import wraps
+import orjson
+from functools import wraps, lru_cache
+from contextlib import asynccontextmanager
 import random
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from collections import Counter
+from collections.abc import Mapping
 
+# Per-user state (diagnostic cache and friends) lives under this directory
+STATE_DIR = os.path.join(os.path.expanduser('~'), '.together_troubleshooter')
+CACHE_DIR = os.path.join(STATE_DIR, 'cache')
+HISTORY_DB_PATH = os.path.join(STATE_DIR, 'history.db')
 
-@dataclass
+# Models tested when the caller doesn't name any
+DEFAULT_MODELS = (
+    "mistralai/Mistral-7B-Instruct-v0.1",
+    "meta-llama/Llama-2-7b-chat-hf",
+    "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO"
+)
+
+# The model catalog is refreshed at most daily; a marker next to it records the last good sync
+MODELS_CATALOG_TTL = 24 * 60 * 60
+
+# Header name prefixes (lowercased) that carry rate limit state
+_RATE_LIMIT_HEADER_PREFIXES = ('x-rate', 'ratelimit', 'rate-limit', 'retry-after')
+
+# Prompts cycled through by the performance test
+_TEST_PROMPTS = (
+    "What is the capital of France?",
+    "Write a haiku about technology.",
+    "Explain quantum computing in simple terms.",
+    "Describe the benefits of renewable energy.",
+    "How does machine learning work?"
+)
+
+# Error conditions probed by the error pattern test; payloads without a
+# "model" key are sent against the model under test
+_ERROR_TEST_CASES = (
+    {
+        "name": "Invalid model",
+        "payload": {"model": "non-existent-model", "prompt": "test", "max_tokens": 1},
+        "expected_status": 400
+    },
+    {
+        "name": "Empty prompt",
+        "payload": {"prompt": "", "max_tokens": 1},
+        "expected_status": 400
+    },
+    {
+        "name": "Excessive max_tokens",
+        "payload": {"prompt": "test", "max_tokens": 100000},
+        "expected_status": 400
+    }
+)
+
+# Inference calls in the performance test may legitimately run longer than API calls
+PERF_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write data to path via a temp file and os.replace so readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _dump_report(report: Dict, compress: bool = False) -> bytes:
+    """Serialize a report for storage, gzipped when compress is set"""
+    # Header-derived details are keyed by aiohttp's istr, a str subclass
+    data = orjson.dumps(report, option=orjson.OPT_NON_STR_KEYS)
+    # Reports repeat model names and canned advice, so even a fast level shrinks them several-fold
+    return gzip.compress(data, compresslevel=3, mtime=0) if compress else data
+
+
+def _load_report(data: bytes) -> Dict:
+    """Parse a stored report, whether or not it was written compressed"""
+    if data[:2] == _GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return orjson.loads(data)
+
+
+def _model_ids(catalog) -> set:
+    """Model ids from a catalog given as ids, model dicts, or an OpenAI-style {"data": [...]}"""
+    # The OpenAI-compatible shape wraps the list as {"data": [...]}
+    if isinstance(catalog, dict):
+        catalog = catalog.get('data', [])
+    return {model if isinstance(model, str) else model['id']
+            for model in catalog if isinstance(model, str) or 'id' in model}
+
+
+def _read_catalog(path: str) -> Optional[List[str]]:
+    """Model ids stored in a catalog file, or None if it is missing or unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            return sorted(_model_ids(orjson.loads(f.read())))
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Linearly interpolated percentile of an already sorted, non-empty list"""
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+@dataclass(slots=True)
 class DiagnosticResult:
     test_name: str
     status: str  # "PASS", "FAIL", "WARNING", "INFO"
@@ -32,94 +153,376 @@ class DiagnosticResult:
     recommendation: str = ""
 
 
+def _env(name: str, convert=str):
+    """Environment variable converted with convert, or None when unset or empty"""
+    value = os.getenv(name)
+    if value is None or value == '':
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError(f"{name}={value!r} is not a valid {convert.__name__.lstrip('_')}") from None
+
+
+def _flag(value: str) -> bool:
+    """Parse a boolean environment setting"""
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(value)
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Troubleshooter settings, resolved and validated once at startup"""
+    base_url: str = 'https://api.together.xyz'
+    timeout: int = 30
+    max_retries: int = 3
+    performance_test_iterations: int = 3
+    concurrent_test_requests: int = 5
+    circuit_breaker_threshold: int = 5
+    circuit_breaker_timeout: float = 60
+    log_level: str = 'INFO'
+    cache_policy: str = 'enabled'
+    cache_ttl: float = 300
+    diag_ttl: float = 10
+    compress: bool = False
+    rpm_limit: Optional[float] = None
+    tpm_limit: Optional[float] = None
+    # Frozen into a read-only mapping by __post_init__, and left out of the hash
+    performance_thresholds: Dict[str, int] = field(hash=False, default_factory=lambda: {
+        'real_time_chat': 2000,
+        'api_backend': 5000,
+        'batch_processing': 30000
+    })
+    
+    def __post_init__(self):
+        # Bad values fail here, at startup, rather than partway through a diagnostic.
+        # Config files can hold any JSON type, so check types before comparing values.
+        for f in fields(self):
+            value = getattr(self, f.name)
+            allowed = get_args(f.type) if get_origin(f.type) is Union else (f.type,)
+            # Mappings pass for dict fields, so a frozen config can seed dataclasses.replace
+            allowed = tuple(Mapping if t is dict else t for t in (get_origin(t) or t for t in allowed))
+            if float in allowed:
+                allowed = (int,) + allowed
+            if not isinstance(value, allowed) or (isinstance(value, bool) and bool not in allowed):
+                expected = " or ".join("null" if t is type(None) else t.__name__ for t in allowed)
+                raise ValueError(f"{f.name} must be {expected}, got {value!r}")
+        for name in ('timeout', 'circuit_breaker_timeout'):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"{name} must be positive, got {getattr(self, name)}")
+        for name in ('max_retries', 'performance_test_iterations', 'cache_ttl', 'diag_ttl'):
+            if getattr(self, name) < 0:
+                raise ValueError(f"{name} must not be negative, got {getattr(self, name)}")
+        for name in ('concurrent_test_requests', 'circuit_breaker_threshold'):
+            if getattr(self, name) < 1:
+                raise ValueError(f"{name} must be at least 1, got {getattr(self, name)}")
+        for name in ('rpm_limit', 'tpm_limit'):
+            if getattr(self, name) is not None and getattr(self, name) <= 0:
+                raise ValueError(f"{name} must be positive when set, got {getattr(self, name)}")
+        if self.cache_policy not in DiagnosticCache.POLICIES:
+            raise ValueError(f"Unknown cache policy {self.cache_policy!r}; "
+                             f"expected one of {', '.join(DiagnosticCache.POLICIES)}")
+        if not isinstance(getattr(logging, self.log_level.upper(), None), int):
+            raise ValueError(f"Unknown log level {self.log_level!r}")
+        for name, value in self.performance_thresholds.items():
+            if not isinstance(name, str) or not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f"performance_thresholds must map names to int milliseconds, "
+                                 f"got {name!r}: {value!r}")
+        # Same idiom as config._freeze: a frozen dataclass shouldn't hand out a mutable dict
+        object.__setattr__(self, 'performance_thresholds',
+                           types.MappingProxyType(dict(self.performance_thresholds)))
+    
+    @classmethod
+    def from_env(cls, **overrides) -> 'Config':
+        """Defaults, overridden by TOGETHER_AI_* environment variables, then by overrides"""
+        unknown = set(overrides) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown config option(s): {', '.join(sorted(unknown))}")
+        
+        env = {
+            'base_url': _env('TOGETHER_AI_BASE_URL'),
+            'timeout': _env('TOGETHER_AI_TIMEOUT', int),
+            'max_retries': _env('TOGETHER_AI_MAX_RETRIES', int),
+            'performance_test_iterations': _env('TOGETHER_AI_PERF_TESTS', int),
+            'concurrent_test_requests': _env('TOGETHER_AI_CONCURRENT', int),
+            'log_level': _env('TOGETHER_AI_LOG_LEVEL'),
+            'cache_policy': _env('TOGETHER_AI_CACHE_POLICY'),
+            'cache_ttl': _env('TOGETHER_AI_CACHE_TTL', float),
+            'diag_ttl': _env('TOGETHER_AI_DIAG_TTL', float),
+            'compress': _env('TOGETHER_AI_COMPRESS', _flag),
+            'rpm_limit': _env('TOGETHER_AI_RPM_LIMIT', float),
+            'tpm_limit': _env('TOGETHER_AI_TPM_LIMIT', float)
+        }
+        settings = {k: v for k, v in env.items() if v is not None}
+        settings.update(overrides)
+        return cls(**settings)
+
+
 def retry_with_backoff(max_retries=3, base_delay=1, max_delay=60, backoff_factor=2):
-    """Decorator for retrying functions with exponential backoff and jitter"""
+    """Decorator for retrying functions with exponential backoff and jitter
+    
+    Coroutine functions get an async wrapper that backs off with asyncio.sleep,
+    so a retry never blocks the event loop.
+    """
+    def should_retry(attempt, e):
+        # An open breaker will keep refusing until it cools off, so don't wait on it
+        return attempt < max_retries and not isinstance(e, CircuitOpenError)
+    
+    def backoff_delay(attempt, e):
+        # Calculate delay with exponential backoff and jitter
+        delay = min(base_delay * (backoff_factor ** attempt), max_delay)
+        jitter = random.uniform(0.1, 0.3) * delay
+        total_delay = delay + jitter
+        
+        logging.warning("Attempt %d failed: %s. Retrying in %.2fs", attempt + 1, e, total_delay)
+        return total_delay
+    
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                for attempt in range(max_retries + 1):
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        if not should_retry(attempt, e):
+                            raise
+                        await asyncio.sleep(backoff_delay(attempt, e))
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
-            
             for attempt in range(max_retries + 1):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
-                    last_exception = e
-                    
-                    if attempt == max_retries:
-                        break
-                    
-                    # Calculate delay with exponential backoff and jitter
-                    delay = min(base_delay * (backoff_factor ** attempt), max_delay)
-                    jitter = random.uniform(0.1, 0.3) * delay
-                    total_delay = delay + jitter
-                    
-                    logging.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {total_delay:.2f}s")
-                    time.sleep(total_delay)
-            
-            raise last_exception
+                    if not should_retry(attempt, e):
+                        raise
+                    time.sleep(backoff_delay(attempt, e))
         return wrapper
     return decorator
 
 
+def _estimate_tokens(payload: Dict) -> int:
+    """Rough token cost of an inference payload: completion budget plus ~4 chars per prompt token"""
+    return payload.get('max_tokens', 0) + len(payload.get('prompt', '')) // 4 + 1
+
+
+class TokenBucket:
+    """Async token bucket pacing requests and tokens to per-minute provider limits
+    
+    Either limit may be None to leave that dimension unthrottled. Only the
+    acquiring coroutine waits; everything else on the loop keeps running.
+    """
+    
+    def __init__(self, rpm_limit=None, tpm_limit=None):
+        self.rpm_limit = float(rpm_limit) if rpm_limit else None
+        self.tpm_limit = float(tpm_limit) if tpm_limit else None
+        self.request_tokens = self.rpm_limit or 0.0
+        self.token_tokens = self.tpm_limit or 0.0
+        self.last_update = time.monotonic()
+    
+    async def acquire(self, est_tokens=0):
+        """Take one request and est_tokens tokens, sleeping until both have refilled"""
+        # A single request larger than the whole budget still has to go through eventually
+        if self.tpm_limit:
+            est_tokens = min(est_tokens, self.tpm_limit)
+        
+        while True:
+            now = time.monotonic()
+            elapsed = now - self.last_update
+            self.last_update = now
+            wait = 0.0
+            
+            if self.rpm_limit:
+                self.request_tokens = min(self.rpm_limit, self.request_tokens + elapsed * self.rpm_limit / 60)
+                wait = max(wait, (1 - self.request_tokens) * 60 / self.rpm_limit)
+            if self.tpm_limit:
+                self.token_tokens = min(self.tpm_limit, self.token_tokens + elapsed * self.tpm_limit / 60)
+                wait = max(wait, (est_tokens - self.token_tokens) * 60 / self.tpm_limit)
+            
+            if wait <= 0:
+                if self.rpm_limit:
+                    self.request_tokens -= 1
+                if self.tpm_limit:
+                    self.token_tokens -= est_tokens
+                return
+            await asyncio.sleep(wait)
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is refusing requests"""
+
+
 class RobustHTTPClient:
-    """HTTP client with retry logic, connection pooling, and circuit breaker"""
+    """Async HTTP client with retry logic, connection pooling, and circuit breaker"""
     
-    def __init__(self, timeout=30, max_retries=3):
-        self.session = requests.Session()
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    MAX_BACKOFF = 30
+    MAX_RETRY_AFTER = 60
+    
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+    
+    def __init__(self, timeout=30, max_retries=3, pool_size=20, max_in_flight=None,
+                 circuit_breaker_threshold=5, circuit_breaker_timeout=60, rate_limiter=None,
+                 headers=None):
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.max_retries = max_retries
+        self.backoff_factor = 0.5
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight or pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.rate_limiter: Optional[TokenBucket] = rate_limiter
+        self.retry_counts = Counter()
         
-        # Configure retry strategy
-        retry_strategy = Retry(
-            total=max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE", "POST"]
-        )
+        self.circuit_breaker_threshold = circuit_breaker_threshold
+        self.circuit_breaker_timeout = circuit_breaker_timeout
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._failures = 0
+    
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared aiohttp session, created lazily on the running event loop"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                # Every call goes to the one API host, so bound the pool per host
+                # rather than globally, and reap sockets left half-closed by TLS
+                connector=aiohttp.TCPConnector(
+                    limit=0,
+                    limit_per_host=self.pool_size,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                    enable_cleanup_closed=True
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers
+            )
+        return self._session
+    
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """Sliding-window cap on in-flight requests, shared by every caller on this loop"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+    
+    async def aclose(self):
+        """Close the shared session and its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._slots = None
+    
+    def _check_circuit_breaker(self):
+        """Let the request through, or raise CircuitOpenError while the breaker is tripped"""
+        if self._state == self.CLOSED:
+            return
         
-        # Mount adapter with retry strategy
-        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.circuit_breaker_timeout:
+            # Cool-off elapsed: admit a single probe to decide whether to close again
+            self._state = self.HALF_OPEN
+            logging.info("Circuit breaker half-open - sending probe request")
+            return
         
-        self.timeout = timeout
-        self.circuit_breaker_threshold = 5
-        self.circuit_breaker_timeout = 60
-        self.failure_count = 0
-        self.last_failure_time = None
-        self.circuit_open = False
+        raise CircuitOpenError("Circuit breaker is open - too many recent failures")
     
-    def _check_circuit_breaker(self):
-        """Check if circuit breaker should be opened/closed"""
-        if self.circuit_open:
-            if time.time() - self.last_failure_time > self.circuit_breaker_timeout:
-                self.circuit_open = False
-                self.failure_count = 0
-                logging.info("Circuit breaker closed - resuming requests")
-            else:
-                raise Exception("Circuit breaker is open - too many recent failures")
+    def _record_success(self):
+        if self._state != self.CLOSED:
+            logging.info("Circuit breaker closed - resuming requests")
+        self._state = self.CLOSED
+        self._failures = 0
     
-    def request(self, method, url, **kwargs):
-        """Make HTTP request with circuit breaker protection"""
+    def _record_failure(self):
+        self._failures += 1
+        
+        if self._state == self.HALF_OPEN or self._failures >= self.circuit_breaker_threshold:
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            logging.error("Circuit breaker opened after %d failures", self._failures)
+    
+    def _backoff_delay(self, attempt, retry_after=None) -> float:
+        """Seconds to wait before the next attempt, preferring the server's Retry-After"""
+        if retry_after is not None:
+            try:
+                return min(max(float(retry_after), 0.0), self.MAX_RETRY_AFTER)
+            except ValueError:
+                pass  # HTTP-date form; fall back to our own schedule
+        return min(self.MAX_BACKOFF, self.backoff_factor * 2 ** attempt) + random.random() * 0.25
+    
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """Make HTTP request with retries and circuit breaker protection
+        
+        Use as ``async with client.request(...) as response:``; the connection is
+        released back to the pool when the block exits. Pass ``est_tokens`` to
+        charge the request's expected token cost against the rate limiter, and
+        ``probe`` to name the test its retries are counted under.
+        """
         self._check_circuit_breaker()
+        slots = self.slots
+        est_tokens = kwargs.pop('est_tokens', 0)
+        probe = kwargs.pop('probe', None) or f"{method} {url}"
         
+        # A half-open probe must settle the breaker one way or another; if it is
+        # cancelled before an outcome (e.g. while waiting on the limiter or a backoff),
+        # treat it as failed so the breaker re-opens instead of staying half-open forever
+        probing = self._state == self.HALF_OPEN
         try:
-            kwargs.setdefault('timeout', self.timeout)
-            response = self.session.request(method, url, **kwargs)
-            
-            # Reset failure count on success
-            if response.status_code < 500:
-                self.failure_count = 0
-            
-            return response
-            
-        except Exception as e:
-            self.failure_count += 1
-            self.last_failure_time = time.time()
-            
-            if self.failure_count >= self.circuit_breaker_threshold:
-                self.circuit_open = True
-                logging.error(f"Circuit breaker opened after {self.failure_count} failures")
-            
-            raise e
+            for attempt in range(self.max_retries + 1):
+                # Every attempt counts against provider limits, retries included
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(est_tokens)
+                
+                # Hold a slot only while a request is on the wire, never across a backoff
+                await slots.acquire()
+                try:
+                    response = await self.session.request(method, url, **kwargs)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    slots.release()
+                    if attempt < self.max_retries:
+                        delay = self._backoff_delay(attempt)
+                        self.retry_counts[probe] += 1
+                        logging.warning("%s failed (%s), retrying in %.2fs", probe, e.__class__.__name__, delay)
+                        await asyncio.sleep(delay)
+                        continue
+                    self._record_failure()
+                    raise
+                except BaseException:
+                    slots.release()
+                    self._record_failure()
+                    raise
+                
+                if response.status in self.RETRY_STATUS_CODES and attempt < self.max_retries:
+                    delay = self._backoff_delay(attempt, response.headers.get('Retry-After'))
+                    response.release()
+                    slots.release()
+                    self.retry_counts[probe] += 1
+                    logging.warning("%s returned %d, retrying in %.2fs", probe, response.status, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                break
+        except BaseException:
+            if probing and self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            raise
+        
+        if response.status < 500:
+            self._record_success()
+        else:
+            self._record_failure()
+        
+        try:
+            yield response
+        finally:
+            response.release()
+            slots.release()
     
     def get(self, url, **kwargs):
         return self.request('GET', url, **kwargs)
@@ -128,74 +531,410 @@ class RobustHTTPClient:
         return self.request('POST', url, **kwargs)
 
 
+class CacheMissError(LookupError):
+    """Raised in replay mode when no captured diagnostic exists for the request"""
+
+
+class CatalogUnavailableError(LookupError):
+    """Raised when a pinned model catalog (TOGETHER_AI_MODELS_PATH) cannot be read"""
+
+
+class DiagnosticCache:
+    """On-disk cache of full diagnostic reports
+    
+    Policies: ``enabled`` reads fresh entries and writes new ones, ``read_only``
+    never writes, ``replay`` serves captured entries regardless of age and raises
+    CacheMissError on a miss, ``write_only`` always re-runs but records the result,
+    and ``disabled`` bypasses the cache entirely.
+    """
+    
+    POLICIES = ('enabled', 'read_only', 'replay', 'write_only', 'disabled')
+    
+    def __init__(self, cache_dir: str = CACHE_DIR, ttl: float = 300, policy: str = 'enabled',
+                 compress: bool = False):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cache policy {policy!r}; expected one of {', '.join(self.POLICIES)}")
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.policy = policy
+        self.compress = compress
+    
+    @staticmethod
+    def key(api_key: str, base_url: str, models: List[str], config: Config) -> str:
+        """Deterministic key over the API key, endpoint, model list and result-affecting config"""
+        settings = {f.name: getattr(config, f.name) for f in fields(config)}
+        settings['base_url'] = base_url
+        settings['performance_thresholds'] = dict(settings['performance_thresholds'])
+        settings = {k: v for k, v in settings.items() if not k.startswith('cache_') and k not in ('log_level', 'diag_ttl', 'compress')}
+        material = "|".join([api_key, ",".join(sorted(models)), json.dumps(settings, sort_keys=True, default=str)])
+        return hashlib.sha256(material.encode()).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached report for key, or None when it must be (re)computed"""
+        if self.policy in ('write_only', 'disabled'):
+            return None
+        
+        path = self._path(key)
+        try:
+            fresh = self.policy == 'replay' or os.path.getmtime(path) > time.time() - self.ttl
+            if fresh:
+                with open(path, 'rb') as f:
+                    return _load_report(f.read())
+        except (OSError, EOFError, zlib.error, orjson.JSONDecodeError):
+            pass
+        
+        if self.policy == 'replay':
+            raise CacheMissError(f"No captured diagnostic for key {key[:12]}")
+        return None
+    
+    def put(self, key: str, report: Dict):
+        """Store report under key, replacing any previous entry atomically"""
+        if self.policy not in ('enabled', 'write_only'):
+            return
+        
+        _atomic_write(self._path(key), _dump_report(report, self.compress))
+
+
+class DiagnosticHistory:
+    """SQLite log of full diagnostic reports, indexed for comparing runs of the same diagnostic"""
+    
+    def __init__(self, path: str = HISTORY_DB_PATH, compress: bool = False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.compress = compress
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS runs(ts INTEGER, key_prefix TEXT, models TEXT, result BLOB, cache_key TEXT);"
+            "CREATE INDEX IF NOT EXISTS ix_runs_key ON runs(cache_key, ts DESC);"
+        )
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def close(self):
+        self.conn.close()
+    
+    def record(self, api_key: str, models: List[str], report: Dict, cache_key: str) -> bool:
+        """Append report, skipping a run already recorded (e.g. one served from the cache)"""
+        ts = int(datetime.fromisoformat(report['timestamp']).timestamp())
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs SELECT ?, ?, ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM runs WHERE cache_key = ? AND ts = ?)",
+                (ts, api_key[:6], json.dumps(sorted(models)),
+                 _dump_report(report, self.compress), cache_key, cache_key, ts)
+            )
+        return cursor.rowcount == 1
+    
+    def last(self, cache_key: str, n: int) -> List[Dict]:
+        """The n most recent reports for cache_key, oldest first"""
+        rows = self.conn.execute(
+            "SELECT result FROM runs WHERE cache_key = ? ORDER BY ts DESC LIMIT ?", (cache_key, n)
+        ).fetchall()
+        return [_load_report(row[0]) for row in reversed(rows)]
+
+
+# Canned advice for customer-reported issues, in the order they take precedence;
+# "general" is the fallback when no keyword matches
+_ISSUE_ADVICE = {
+    "service_unavailable": """
+503 Service Unavailable - Possible Causes:
+• Together AI servers are temporarily overloaded
+• Scheduled maintenance or capacity issues
+• Regional outages or network problems
+
+Recommended Actions:
+1. Check status.together.ai for known issues
+2. Implement retry logic with exponential backoff
+3. Consider switching to dedicated instances for guaranteed capacity
+4. If persistent, contact Together AI support
+""",
+    "rate_limit": """
+429 Rate Limit Exceeded - Possible Causes:
+• Exceeding requests per second (RPS) limits
+• Exceeding tokens per second (TPS) limits  
+• Burst traffic patterns overwhelming limits
+
+Recommended Actions:
+1. Implement request queuing and rate limiting
+2. Use exponential backoff for retries
+3. Monitor rate limit headers in responses
+4. Request higher limits at together.ai/forms/rate-limit-increase
+5. Consider upgrading to Scale or Enterprise tiers
+""",
+    "auth_failed": """
+401 Authentication Failed - Possible Causes:
+• Invalid or expired API key
+• API key not included in Authorization header
+• Incorrect header format
+
+Recommended Actions:
+1. Verify API key at api.together.ai Settings > API Keys
+2. Ensure header format: "Authorization: Bearer YOUR_API_KEY"
+3. Regenerate API key if compromised
+4. Check if API key has required permissions
+""",
+    "bad_request": """
+400 Bad Request - Possible Causes:
+• Invalid request format or parameters
+• Missing required fields (model, prompt)
+• Invalid model name or unavailable model
+• Excessive max_tokens parameter
+
+Recommended Actions:
+1. Validate request payload against API documentation
+2. Check model name using /models endpoint
+3. Ensure max_tokens is within model limits
+4. Verify all required fields are present
+""",
+    "timeout": """
+Timeout/Slow Response Issues - Possible Causes:
+• Large models taking longer to generate responses
+• High system load during peak hours
+• Complex prompts requiring more processing
+• Network latency issues
+
+Recommended Actions:
+1. Increase client timeout values
+2. Use smaller/faster models for time-critical applications
+3. Implement async processing for long requests
+4. Consider dedicated instances for consistent performance
+5. Optimize prompts to be more specific and concise
+""",
+    "general": """
+General Troubleshooting Steps:
+1. Run full diagnostic using this tool
+2. Check Together AI status page
+3. Verify API key and permissions
+4. Test with different models and simple prompts
+5. Implement proper error handling and retries
+6. Monitor rate limits and usage patterns
+7. Contact Together AI support with specific error details
+"""
+}
+
+# Report keywords that point to each advice category
+_ISSUE_KEYWORDS = {
+    "service_unavailable": ("503",),
+    "rate_limit": ("429", "rate limit"),
+    "auth_failed": ("401", "authentication", "unauthorized"),
+    "bad_request": ("400", "bad request"),
+    "timeout": ("timeout", "slow")
+}
+
+_ISSUE_PRIORITY = {category: rank for rank, category in enumerate(_ISSUE_ADVICE)}
+
+# One scan over the lowercased report finds every keyword instead of one substring
+# search per keyword. Each category is a named group, so a match's lastgroup is
+# its category; groups follow precedence and keywords run longest first.
+_ISSUE_PATTERN = re.compile('|'.join(
+    f"(?P<{category}>{'|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))})"
+    for category, keywords in sorted(_ISSUE_KEYWORDS.items(), key=lambda item: _ISSUE_PRIORITY[item[0]])
+))
+
+# Typo budget per keyword. Short keywords (status codes, "slow") stay exact, since
+# one edit would turn them into unrelated words; only long keywords get two.
+def _typo_budget(keyword: str) -> int:
+    return 0 if len(keyword) < 5 else 1 if len(keyword) <= 10 else 2
+
+
+# (category, keyword, char -> pattern bitmask, typo budget) in precedence order
+_FUZZY_KEYWORDS = tuple(
+    (category, keyword, {c: sum(1 << i for i, ch in enumerate(keyword) if ch == c) for c in set(keyword)},
+     _typo_budget(keyword))
+    for category in _ISSUE_PRIORITY
+    for keyword in _ISSUE_KEYWORDS.get(category, ())
+    if _typo_budget(keyword) > 0
+)
+
+_REPORT_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _within_edits(peq: Dict[str, int], m: int, max_edits: int, candidate: str) -> bool:
+    """Whether candidate is within max_edits edits of the keyword (Myers' bit-parallel distance)"""
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    
+    for c in candidate:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    
+    return score <= max_edits
+
+
+def _fuzzy_classify(normalized: str) -> Optional[str]:
+    """Category of the first keyword that a word, or pair of adjacent words, misspells"""
+    words = _REPORT_WORD.findall(normalized)
+    # Pairs catch split or joined keywords ("time out", "ratelimit" against "rate limit")
+    candidates = set(words).union(map(" ".join, zip(words, words[1:])))
+    
+    for category, keyword, peq, max_edits in _FUZZY_KEYWORDS:
+        m = len(keyword)
+        for candidate in candidates:
+            # Typos rarely hit the first letter; requiring it keeps "date limit" away from
+            # "rate limit", and the length check skips most words without scoring them
+            if (candidate[0] == keyword[0] and abs(len(candidate) - m) <= max_edits
+                    and _within_edits(peq, m, max_edits, candidate)):
+                return category
+    
+    return None
+
+
+def _normalize_report(report: str) -> str:
+    """Lowercase a report and collapse its whitespace, so near-identical tickets share a cache entry"""
+    return " ".join(report.lower().split())
+
+
+@lru_cache(maxsize=4096)
+def _classify(normalized: str) -> str:
+    """Advice category for a normalized customer report; repeated reports hit the cache
+    
+    >>> _classify("requests timout after a minute"), _classify("got an unathorized error")
+    ('timeout', 'auth_failed')
+    >>> _classify("message limit reached"), _classify("page limit"), _classify("the date limit")
+    ('general', 'general', 'general')
+    >>> _classify("my key is authorized for this model but nothing works")
+    'general'
+    """
+    best, best_rank = "general", len(_ISSUE_PRIORITY)
+    
+    for match in _ISSUE_PATTERN.finditer(normalized):
+        rank = _ISSUE_PRIORITY[match.lastgroup]
+        if rank < best_rank:
+            best, best_rank = match.lastgroup, rank
+            if rank == 0:
+                break  # Nothing outranks the top category, so stop scanning
+    
+    if best_rank == len(_ISSUE_PRIORITY):
+        # No exact keyword; tolerate typos like "timout" or "unathorized"
+        return _fuzzy_classify(normalized) or best
+    
+    return best
+
+
 class TogetherAITroubleshooter:
-    def __init__(self, api_key: str, base_url: str = None, config: Dict = None):
-        # Configuration management
-        self.config = self._load_config(config)
+    _logging_configured = False
+    _log_file_handler: Optional[logging.Handler] = None
+    
+    def __init__(self, api_key: str, base_url: str = None, config: Optional[Config] = None):
+        # Configuration management; a plain dict is layered over the environment like before
+        self.config = config if isinstance(config, Config) else Config.from_env(**(config or {}))
         self.api_key = api_key
-        self.base_url = base_url or self.config.get('base_url', 'https://api.together.xyz')
+        self.base_url = base_url or self.config.base_url
+        
+        # Accounts see different models (fine-tunes, dedicated endpoints), so the local
+        # catalog is kept per API key and endpoint like the diagnostic cache
+        catalog_id = hashlib.sha256(f"{self.api_key}|{self.base_url}".encode()).hexdigest()[:16]
+        self.catalog_path = os.path.join(CACHE_DIR, f"models-{catalog_id}.json")
+        self.catalog_marker = os.path.join(CACHE_DIR, f".last_sync-{catalog_id}")
+        
+        # Snapshot settings read on every test run
+        self.perf_iters = self.config.performance_test_iterations
+        self.concurrent = self.config.concurrent_test_requests
+        self.api_backend_threshold = self.config.performance_thresholds.get('api_backend', 5000)
         
         # Setup logging
         self._setup_logging()
         
-        # Initialize robust HTTP client
-        self.http_client = RobustHTTPClient(
-            timeout=self.config.get('timeout', 30),
-            max_retries=self.config.get('max_retries', 3)
-        )
-        
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
-        self.results = []
-    
-    def _load_config(self, config: Dict = None) -> Dict:
-        """Load configuration from multiple sources with environment variable support"""
-        default_config = {
-            'base_url': 'https://api.together.xyz',
-            'timeout': 30,
-            'max_retries': 3,
-            'performance_test_iterations': 3,
-            'concurrent_test_requests': 5,
-            'circuit_breaker_threshold': 5,
-            'circuit_breaker_timeout': 60,
-            'log_level': 'INFO',
-            'performance_thresholds': {
-                'real_time_chat': 2000,
-                'api_backend': 5000,
-                'batch_processing': 30000
-            }
-        }
         
-        # Override with environment variables
-        env_config = {
-            'base_url': os.getenv('TOGETHER_AI_BASE_URL'),
-            'timeout': int(os.getenv('TOGETHER_AI_TIMEOUT', '30')),
-            'max_retries': int(os.getenv('TOGETHER_AI_MAX_RETRIES', '3')),
-            'log_level': os.getenv('TOGETHER_AI_LOG_LEVEL', 'INFO')
-        }
+        # Initialize robust HTTP client; its pooled session is shared by every test
+        # and sends the auth headers by default
+        self.http_client = RobustHTTPClient(
+            timeout=self.config.timeout,
+            max_retries=self.config.max_retries,
+            pool_size=self.concurrent * 4,
+            max_in_flight=self.concurrent,
+            circuit_breaker_threshold=self.config.circuit_breaker_threshold,
+            circuit_breaker_timeout=self.config.circuit_breaker_timeout,
+            # Pace probes below the account's limits so the tool doesn't cause the 429s it diagnoses
+            rate_limiter=TokenBucket(self.config.rpm_limit, self.config.tpm_limit),
+            headers=self.headers
+        )
         
-        # Merge configurations
-        final_config = default_config.copy()
-        final_config.update({k: v for k, v in env_config.items() if v is not None})
-        if config:
-            final_config.update(config)
-            
-        return final_config
+        # Full diagnostic reports are cached on disk to skip redundant reruns
+        self.cache = DiagnosticCache(
+            ttl=self.config.cache_ttl,
+            policy=self.config.cache_policy,
+            compress=self.config.compress
+        )
+        
+        # Repeat callers (e.g. a health-check endpoint) within diag_ttl seconds share one run
+        self._ttl = self.config.diag_ttl
+        self._last_result: Optional[Dict] = None
+        self._last_key: Optional[Tuple] = None
+        self._last_ts = 0.0
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._diag_lock = threading.Lock()
+        self._run_lock: Optional[asyncio.Lock] = None
+        
+        self.results = []
+        self._models_body: Optional[bytes] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
     
     def _setup_logging(self):
-        """Setup structured logging"""
-        log_level = getattr(logging, self.config.get('log_level', 'INFO').upper())
+        """Setup structured logging, once per process"""
+        self.logger = logging.getLogger(__name__)
+        if TogetherAITroubleshooter._logging_configured:
+            return
+        TogetherAITroubleshooter._logging_configured = True
+        
+        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        
+        # Batch file writes; anything at WARNING or above is flushed immediately.
+        # The buffer only forwards records, so the formatter goes on the file itself.
+        file_target = logging.FileHandler('together_ai_troubleshooter.log')
+        file_target.setFormatter(logging.Formatter(log_format))
+        # The buffer drops its target when closed at exit; keep the file handler
+        # referenced so logging.shutdown still gets to close the file afterwards
+        TogetherAITroubleshooter._log_file_handler = file_target
+        file_handler = logging.handlers.MemoryHandler(
+            capacity=100,
+            flushLevel=logging.WARNING,
+            target=file_target
+        )
+        log_level = getattr(logging, self.config.log_level.upper())
         logging.basicConfig(
             level=log_level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            format=log_format,
             handlers=[
                 logging.StreamHandler(),
-                logging.FileHandler('together_ai_troubleshooter.log')
+                file_handler
             ]
         )
-        self.logger = logging.getLogger(__name__)
 
     def add_result(self, result: DiagnosticResult):
         """Add a diagnostic result"""
@@ -204,50 +943,57 @@ class TogetherAITroubleshooter:
         if result.recommendation:
             print(f"  → Recommendation: {result.recommendation}")
 
-    @retry_with_backoff(max_retries=3, base_delay=1)
     def test_api_connectivity(self) -> DiagnosticResult:
+        """Test basic API connectivity with robust error handling"""
+        return self._run_sync(self.test_api_connectivity_async())
+
+    @retry_with_backoff(max_retries=3, base_delay=1)
+    async def test_api_connectivity_async(self) -> DiagnosticResult:
         """Test basic API connectivity with robust error handling"""
         try:
             self.logger.info("Testing API connectivity...")
             # Test with a simple model list request using robust HTTP client
-            response = self.http_client.get(
-                f"{self.base_url}/v1/models",
-                headers={"Authorization": f"Bearer {self.api_key}"}
-            )
-            
-            if response.status_code == 200:
-                return DiagnosticResult(
-                    "API Connectivity",
-                    "PASS",
-                    f"Successfully connected to Together AI API (Status: {response.status_code})",
-                    {"response_time_ms": response.elapsed.total_seconds() * 1000}
-                )
-            elif response.status_code == 401:
-                return DiagnosticResult(
-                    "API Connectivity",
-                    "FAIL",
-                    "Authentication failed - Invalid API key",
-                    {"status_code": response.status_code},
-                    "Check your API key in Settings > API Keys at api.together.ai"
-                )
-            else:
-                return DiagnosticResult(
-                    "API Connectivity",
-                    "FAIL",
-                    f"API request failed with status {response.status_code}",
-                    {"status_code": response.status_code, "response": response.text[:200]},
-                    "Check Together AI status page at status.together.ai"
-                )
+            start_time = time.perf_counter()
+            async with self.http_client.get(f"{self.base_url}/v1/models", probe="API Connectivity") as response:
+                response_time = (time.perf_counter() - start_time) * 1000
+                
+                if response.status == 200:
+                    # The body is the live model catalog; keep it so availability needn't refetch it
+                    self._models_body = await response.read()
+                    return DiagnosticResult(
+                        "API Connectivity",
+                        "PASS",
+                        f"Successfully connected to Together AI API (Status: {response.status})",
+                        {"response_time_ms": response_time}
+                    )
+                elif response.status == 401:
+                    return DiagnosticResult(
+                        "API Connectivity",
+                        "FAIL",
+                        "Authentication failed - Invalid API key",
+                        {"status_code": response.status},
+                        "Check your API key in Settings > API Keys at api.together.ai"
+                    )
+                else:
+                    # Read only the head of the body; error pages can be arbitrarily large
+                    snippet = (await response.content.read(256)).decode('utf-8', 'replace')[:200]
+                    return DiagnosticResult(
+                        "API Connectivity",
+                        "FAIL",
+                        f"API request failed with status {response.status}",
+                        {"status_code": response.status, "response": snippet},
+                        "Check Together AI status page at status.together.ai"
+                    )
                 
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
             return DiagnosticResult(
                 "API Connectivity",
                 "FAIL",
-                "Request timed out after 10 seconds",
+                f"Request timed out after {self.http_client.timeout} seconds",
                 None,
                 "Check your network connection and Together AI status"
             )
-        except requests.exceptions.ConnectionError:
+        except aiohttp.ClientConnectionError:
             return DiagnosticResult(
                 "API Connectivity",
                 "FAIL",
@@ -257,6 +1003,10 @@ class TogetherAITroubleshooter:
             )
 
     def test_rate_limits(self, model: str = "mistralai/Mistral-7B-Instruct-v0.1") -> DiagnosticResult:
+        """Test current rate limit status"""
+        return self._run_sync(self.test_rate_limits_async(model))
+
+    async def test_rate_limits_async(self, model: str = "mistralai/Mistral-7B-Instruct-v0.1") -> DiagnosticResult:
         """Test current rate limit status"""
         try:
             # Make a simple completion request to check rate limit headers
@@ -267,21 +1017,22 @@ class TogetherAITroubleshooter:
                 "temperature": 0.1
             }
             
-            response = self.http_client.post(
+            async with self.http_client.post(
                 f"{self.base_url}/inference",
-                headers=self.headers,
-                json=payload
-            )
+                data=orjson.dumps(payload),
+                est_tokens=_estimate_tokens(payload),
+                probe="Rate Limits"
+            ) as response:
+                status_code = response.status
+                headers = response.headers
             
             # Check rate limit headers
-            headers = response.headers
-            rate_limit_info = {}
-            
-            for header in headers:
-                if 'rate-limit' in header.lower() or 'ratelimit' in header.lower():
-                    rate_limit_info[header] = headers[header]
+            rate_limit_info = {
+                name: value for name, value in headers.items()
+                if name.lower().startswith(_RATE_LIMIT_HEADER_PREFIXES)
+            }
             
-            if response.status_code == 429:
+            if status_code == 429:
                 retry_after = headers.get('retry-after', 'Unknown')
                 return DiagnosticResult(
                     "Rate Limits",
@@ -290,7 +1041,7 @@ class TogetherAITroubleshooter:
                     {"retry_after": retry_after, "rate_limit_headers": rate_limit_info},
                     "Implement exponential backoff or request rate limit increase at together.ai/forms/rate-limit-increase"
                 )
-            elif response.status_code == 200:
+            elif status_code == 200:
                 return DiagnosticResult(
                     "Rate Limits",
                     "PASS",
@@ -301,8 +1052,8 @@ class TogetherAITroubleshooter:
                 return DiagnosticResult(
                     "Rate Limits",
                     "WARNING",
-                    f"Unexpected status code: {response.status_code}",
-                    {"status_code": response.status_code, "rate_limit_headers": rate_limit_info}
+                    f"Unexpected status code: {status_code}",
+                    {"status_code": status_code, "rate_limit_headers": rate_limit_info}
                 )
                 
         except Exception as e:
@@ -314,25 +1065,91 @@ class TogetherAITroubleshooter:
                 "Check API connectivity and model availability"
             )
 
-    def test_model_availability(self, models_to_test: List[str]) -> List[DiagnosticResult]:
+    def test_model_availability(self, models_to_test: List[str],
+                                available_models: List[str] = None) -> List[DiagnosticResult]:
         """Test availability of specific models"""
+        return self._run_sync(self.test_model_availability_async(models_to_test, available_models))
+
+    async def _fetch_models_async(self) -> Tuple[int, set]:
+        """Fetch the live model catalog as (status, ids); ids is empty unless status is 200"""
+        async with self.http_client.get(f"{self.base_url}/v1/models", probe="Model Availability") as response:
+            if response.status != 200:
+                return response.status, set()
+            return response.status, _model_ids(orjson.loads(await response.read()))
+
+    def load_models_catalog(self, disable_remote: bool = False) -> Optional[List[str]]:
+        """Model ids from the local catalog cache, refreshed from /v1/models once stale"""
+        return self._run_sync(self.load_models_catalog_async(disable_remote))
+
+    async def load_models_catalog_async(self, disable_remote: bool = False) -> Optional[List[str]]:
+        """Model ids from the local catalog cache, refreshed from /v1/models once stale
+        
+        TOGETHER_AI_MODELS_PATH names a catalog file to use as-is, for air-gapped use;
+        CatalogUnavailableError is raised if it can't be read. A failed refresh falls
+        back to the stale copy; None means no catalog is available and the diagnostic
+        should fetch the live one itself.
+        """
+        override = os.getenv('TOGETHER_AI_MODELS_PATH')
+        if override:
+            catalog = _read_catalog(override)
+            if catalog is None:
+                raise CatalogUnavailableError(
+                    f"TOGETHER_AI_MODELS_PATH={override!r} is missing or not a readable model catalog")
+            return catalog
+        
+        cached = _read_catalog(self.catalog_path)
+        try:
+            fresh = os.path.getmtime(self.catalog_marker) > time.time() - MODELS_CATALOG_TTL
+        except OSError:
+            fresh = False
+        
+        if disable_remote or (fresh and cached is not None):
+            return cached
+        
+        try:
+            status, ids = await self._fetch_models_async()
+        except Exception as e:
+            self.logger.warning("Model catalog refresh failed, using cached copy: %s", e)
+            return cached
+        if status != 200:
+            self.logger.warning("Model catalog refresh returned status %d, using cached copy", status)
+            return cached
+        
+        return self._store_catalog(ids)
+
+    def _store_catalog(self, ids: set) -> List[str]:
+        """Save a freshly fetched catalog as the local copy and mark it synced"""
+        catalog = sorted(ids)
+        try:
+            _atomic_write(self.catalog_path, orjson.dumps(catalog))
+            with open(self.catalog_marker, 'a'):
+                os.utime(self.catalog_marker)
+        except OSError as e:
+            self.logger.warning("Could not store model catalog: %s", e)
+        return catalog
+
+    async def test_model_availability_async(self, models_to_test: List[str],
+                                            available_models: List[str] = None) -> List[DiagnosticResult]:
+        """Test availability of specific models, against a preloaded catalog when given"""
         results = []
         
         try:
-            # Get available models using robust HTTP client
-            response = self.http_client.get(f"{self.base_url}/v1/models", headers=self.headers)
-            
-            if response.status_code != 200:
-                results.append(DiagnosticResult(
-                    "Model Availability",
-                    "FAIL",
-                    f"Cannot fetch model list (Status: {response.status_code})",
-                    None,
-                    "Check API connectivity"
-                ))
-                return results
+            if available_models is None:
+                # Get available models using robust HTTP client
+                status, available_models = await self._fetch_models_async()
+                if status != 200:
+                    results.append(DiagnosticResult(
+                        "Model Availability",
+                        "FAIL",
+                        f"Cannot fetch model list (Status: {status})",
+                        None,
+                        "Check API connectivity"
+                    ))
+                    return results
+            else:
+                available_models = set(available_models)
             
-            available_models = [model.get('id', '') for model in response.json()]
+            available_count = len(available_models)
             
             for model in models_to_test:
                 if model in available_models:
@@ -347,7 +1164,7 @@ class TogetherAITroubleshooter:
                         f"Model: {model}",
                         "FAIL",
                         "Model not found in available models",
-                        {"model": model, "available_count": len(available_models)},
+                        {"model": model, "available_count": available_count},
                         "Check model name spelling or use /models endpoint to see available models"
                     ))
                     
@@ -362,17 +1179,48 @@ class TogetherAITroubleshooter:
             
         return results
 
-    async def _make_async_request(self, session, url, headers, payload):
+    @property
+    def run_lock(self) -> asyncio.Lock:
+        """Serializes diagnostic runs on this loop, since they share self.results"""
+        if self._run_lock is None:
+            self._run_lock = asyncio.Lock()
+        return self._run_lock
+
+    async def aclose(self):
+        """Close the shared HTTP session and its pooled connections"""
+        await self.http_client.aclose()
+        self._run_lock = None
+
+    def _run_sync(self, coro):
+        """Run a coroutine on the troubleshooter's own event loop
+        
+        The loop, and the pooled session bound to it, persist between calls so
+        every sync entry point reuses warm connections; close() releases both.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        """Close the HTTP session and the event loop behind the sync API"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.run_until_complete(self.aclose())
+            self._loop.close()
+        self._loop = None
+
+    async def _make_async_request(self, session, url, payload):
         """Make async HTTP request for concurrent testing"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
-            async with session.post(url, headers=headers, json=payload) as response:
-                end_time = time.time()
+            async with session.post(url, data=orjson.dumps(payload), timeout=PERF_REQUEST_TIMEOUT) as response:
+                end_time = time.perf_counter()
                 response_time = (end_time - start_time) * 1000
                 
                 if response.status == 200:
-                    response_data = await response.json()
-                    tokens_generated = len(response_data.get('output', {}).get('choices', [{}])[0].get('text', '').split())
+                    response_data = orjson.loads(await response.read())
+                    text = response_data.get('output', {}).get('choices', [{}])[0].get('text', '') or ''
+                    # Coarse word count for the TPS estimate, without building a list of words
+                    tokens_generated = text.count(' ') + 1 if text else 0
                     return {
                         'success': True,
                         'response_time': response_time,
@@ -387,7 +1235,7 @@ class TogetherAITroubleshooter:
                         'status_code': response.status
                     }
         except Exception as e:
-            end_time = time.time()
+            end_time = time.perf_counter()
             return {
                 'success': False,
                 'response_time': (end_time - start_time) * 1000,
@@ -398,71 +1246,63 @@ class TogetherAITroubleshooter:
     async def test_inference_performance_async(self, model: str, num_tests: int = None) -> DiagnosticResult:
         """Test inference performance with concurrent requests and detailed metrics"""
         try:
-            num_tests = num_tests or self.config.get('performance_test_iterations', 3)
-            concurrent_requests = self.config.get('concurrent_test_requests', 5)
+            num_tests = num_tests or self.perf_iters
+            concurrent_requests = self.concurrent
             
-            self.logger.info(f"Testing performance with {num_tests} requests, {concurrent_requests} concurrent")
-            
-            test_prompts = [
-                "What is the capital of France?",
-                "Write a haiku about technology.",
-                "Explain quantum computing in simple terms.",
-                "Describe the benefits of renewable energy.",
-                "How does machine learning work?"
-            ]
+            self.logger.info("Testing performance with %d requests, %d concurrent", num_tests, concurrent_requests)
             
             # Prepare requests
-            requests_data = []
-            for i in range(num_tests):
-                prompt = test_prompts[i % len(test_prompts)]
-                payload = {
+            requests_data = [
+                {
                     "model": model,
-                    "prompt": prompt,
+                    "prompt": _TEST_PROMPTS[i % len(_TEST_PROMPTS)],
                     "max_tokens": 50,
                     "temperature": 0.7
                 }
-                requests_data.append(payload)
+                for i in range(num_tests)
+            ]
             
-            # Execute concurrent requests
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
-                tasks = []
-                for payload in requests_data:
-                    task = self._make_async_request(
-                        session, 
-                        f"{self.base_url}/inference", 
-                        self.headers, 
-                        payload
-                    )
-                    tasks.append(task)
-                
-                # Execute in batches to avoid overwhelming the API
-                results = []
-                for i in range(0, len(tasks), concurrent_requests):
-                    batch = tasks[i:i + concurrent_requests]
-                    batch_results = await asyncio.gather(*batch, return_exceptions=True)
-                    results.extend(batch_results)
-                    
-                    # Small delay between batches
-                    if i + concurrent_requests < len(tasks):
-                        await asyncio.sleep(0.5)
+            # Execute concurrent requests over the shared, pooled session
+            session = self.http_client.session
+            url = f"{self.base_url}/inference"
+            
+            # Share the client's in-flight cap; a slot frees up as soon as any request finishes
+            slots = self.http_client.slots
+            
+            rate_limiter = self.http_client.rate_limiter
+            
+            async def guarded(payload):
+                # Wait on the rate limiter before taking a slot, so pacing never idles a slot
+                if rate_limiter is not None:
+                    await rate_limiter.acquire(_estimate_tokens(payload))
+                async with slots:
+                    return await self._make_async_request(session, url, payload)
+            
+            results = await asyncio.gather(
+                *(guarded(payload) for payload in requests_data),
+                return_exceptions=True
+            )
             
             # Process results
             successful_requests = [r for r in results if isinstance(r, dict) and r.get('success')]
             failed_requests = [r for r in results if isinstance(r, dict) and not r.get('success')]
             
             if successful_requests:
-                response_times = [r['response_time'] for r in successful_requests]
-                tokens_generated = [r.get('tokens_generated', 0) for r in successful_requests]
+                # Sort once; min, max and percentiles then come straight from the ordering
+                response_times = sorted(r['response_time'] for r in successful_requests)
+                total_response_time = math.fsum(response_times)
                 
-                avg_time = statistics.mean(response_times)
-                max_time = max(response_times)
-                min_time = min(response_times)
-                total_tokens = sum(tokens_generated)
-                avg_tokens_per_second = total_tokens / (sum(response_times) / 1000) if response_times else 0
+                avg_time = total_response_time / len(response_times)
+                min_time = response_times[0]
+                max_time = response_times[-1]
+                p50_time = _percentile(response_times, 50)
+                p95_time = _percentile(response_times, 95)
+                p99_time = _percentile(response_times, 99)
+                total_tokens = sum(r.get('tokens_generated', 0) for r in successful_requests)
+                avg_tokens_per_second = total_tokens / (total_response_time / 1000) if total_response_time else 0
                 
                 # Determine status based on performance thresholds
-                thresholds = self.config.get('performance_thresholds', {})
-                api_backend_threshold = thresholds.get('api_backend', 5000)
+                api_backend_threshold = self.api_backend_threshold
                 
                 status = "PASS"
                 recommendation = ""
@@ -482,6 +1322,9 @@ class TogetherAITroubleshooter:
                         "avg_response_time_ms": avg_time,
                         "min_response_time_ms": min_time,
                         "max_response_time_ms": max_time,
+                        "p50_response_time_ms": p50_time,
+                        "p95_response_time_ms": p95_time,
+                        "p99_response_time_ms": p99_time,
                         "successful_requests": len(successful_requests),
                         "failed_requests": len(failed_requests),
                         "total_tokens_generated": total_tokens,
@@ -501,7 +1344,7 @@ class TogetherAITroubleshooter:
                 )
                 
         except Exception as e:
-            self.logger.error(f"Performance test error: {str(e)}")
+            self.logger.error("Performance test error: %s", e)
             return DiagnosticResult(
                 "Inference Performance",
                 "FAIL",
@@ -512,7 +1355,7 @@ class TogetherAITroubleshooter:
 
     def test_inference_performance(self, model: str, num_tests: int = 3) -> DiagnosticResult:
         """Synchronous wrapper for async performance testing"""
-        return asyncio.run(self.test_inference_performance_async(model, num_tests))
+        return self._run_sync(self.test_inference_performance_async(model, num_tests))
 
     def test_billing_status(self) -> DiagnosticResult:
         """Test billing and account status"""
@@ -538,42 +1381,37 @@ class TogetherAITroubleshooter:
             )
 
     def test_error_patterns(self, model: str) -> DiagnosticResult:
+        """Test for common error patterns"""
+        return self._run_sync(self.test_error_patterns_async(model))
+
+    async def test_error_patterns_async(self, model: str) -> DiagnosticResult:
         """Test for common error patterns"""
         try:
             # Test various error conditions
-            test_cases = [
-                {
-                    "name": "Invalid model",
-                    "payload": {"model": "non-existent-model", "prompt": "test", "max_tokens": 1},
-                    "expected_status": 400
-                },
-                {
-                    "name": "Empty prompt",
-                    "payload": {"model": model, "prompt": "", "max_tokens": 1},
-                    "expected_status": 400
-                },
-                {
-                    "name": "Excessive max_tokens",
-                    "payload": {"model": model, "prompt": "test", "max_tokens": 100000},
-                    "expected_status": 400
-                }
-            ]
+            test_cases = _ERROR_TEST_CASES
+            
+            async def probe(payload):
+                async with self.http_client.post(
+                    f"{self.base_url}/inference",
+                    data=orjson.dumps(payload),
+                    probe="Error Handling"
+                ) as response:
+                    return response.status
+            
+            statuses = await asyncio.gather(
+                *(probe({"model": model, **test_case["payload"]}) for test_case in test_cases),
+                return_exceptions=True
+            )
             
             error_results = []
             
-            for test_case in test_cases:
-                response = self.http_client.post(
-                    f"{self.base_url}/inference",
-                    headers=self.headers,
-                    json=test_case["payload"]
-                )
-                
-                if response.status_code == test_case["expected_status"]:
+            for test_case, status_code in zip(test_cases, statuses):
+                if isinstance(status_code, Exception):
+                    error_results.append(f"✗ {test_case['name']}: Request failed ({status_code})")
+                elif status_code == test_case["expected_status"]:
                     error_results.append(f"✓ {test_case['name']}: Correctly handled")
                 else:
-                    error_results.append(f"✗ {test_case['name']}: Unexpected status {response.status_code}")
-                
-                time.sleep(0.5)  # Brief pause between tests
+                    error_results.append(f"✗ {test_case['name']}: Unexpected status {status_code}")
             
             return DiagnosticResult(
                 "Error Handling",
@@ -590,45 +1428,166 @@ class TogetherAITroubleshooter:
                 None
             )
 
-    def run_full_diagnostic(self, models_to_test: List[str] = None) -> Dict:
+    def run_full_diagnostic(self, models_to_test: List[str] = None,
+                            available_models: List[str] = None) -> Dict:
         """Run complete diagnostic suite"""
+        # Threads queue here rather than racing on the shared loop; by the time a
+        # waiter gets in, the run it waited on is fresh in the memo
+        with self._diag_lock:
+            return self._run_sync(self.run_full_diagnostic_async(models_to_test, available_models))
+
+    async def run_full_diagnostic_async(self, models_to_test: List[str] = None,
+                                        available_models: List[str] = None) -> Dict:
+        """Run complete diagnostic suite, sharing recent or in-flight runs for the same inputs"""
+        run_key = (tuple(models_to_test) if models_to_test is not None else None,
+                   frozenset(available_models) if available_models is not None else None)
+        
+        # Each caller gets its own copy, so one mutating its report can't touch another's
+        now = time.monotonic()
+        if (self._last_result is not None and run_key == self._last_key
+                and now - self._last_ts < self._ttl):
+            return copy.deepcopy(self._last_result)
+        
+        # Single-flight: coroutines arriving during a miss await the run already under way
+        inflight = self._inflight.get(run_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._run_full_diagnostic(models_to_test, available_models))
+            self._inflight[run_key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(run_key, None))
+        
+        report = await asyncio.shield(inflight)
+        self._last_result, self._last_key, self._last_ts = report, run_key, time.monotonic()
+        return copy.deepcopy(report)
+
+    async def _run_full_diagnostic(self, models_to_test: Optional[List[str]],
+                                   available_models: Optional[List[str]], out=None) -> Dict:
+        """Run complete diagnostic suite on one event loop sharing one HTTP session
+        
+        With out, a binary file, each result is also written to it as an NDJSON line.
+        """
         print("=== Together AI Inference Troubleshooting Tool ===\n")
         
         if models_to_test is None:
-            models_to_test = [
-                "mistralai/Mistral-7B-Instruct-v0.1",
-                "meta-llama/Llama-2-7b-chat-hf",
-                "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO"
-            ]
+            models_to_test = list(DEFAULT_MODELS)
         
-        # Test 1: API Connectivity
-        self.add_result(self.test_api_connectivity())
+        cache_key = DiagnosticCache.key(self.api_key, self.base_url, models_to_test, self.config)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print(f"Using cached diagnostic results from {cached['timestamp']}")
+            if out is not None:
+                self._write_events(out, cached['results'])
+            print(cached['summary'])
+            return cached
         
-        # Test 2: Rate Limits
-        if self.results[-1].status != "FAIL":
-            self.add_result(self.test_rate_limits(models_to_test[0]))
+        # Runs collect into shared state (self.results, retry counts), so runs for
+        # different model lists take turns instead of interleaving
+        async with self.run_lock:
+            async for event in self.iter_diagnostic(models_to_test, available_models):
+                if out is not None:
+                    self._write_events(out, (event,))
+            report = self._build_report()
+            
+            # A run that never reached the API says nothing worth replaying
+            if self.results[0].status != "FAIL":
+                self.cache.put(cache_key, report)
+        
+        return report
+
+    def stream_diagnostic(self, out, models_to_test: List[str] = None,
+                          available_models: List[str] = None) -> Dict:
+        """Run a diagnostic, writing each result to the binary file out as an NDJSON line
+        
+        Results stream as they complete; a cached report is written out whole, and the
+        cache policy applies as for run_full_diagnostic.
+        """
+        with self._diag_lock:
+            return self._run_sync(self._run_full_diagnostic(models_to_test, available_models, out))
+
+    @staticmethod
+    def _write_events(out, events):
+        for event in events:
+            # Flushed per line, so a crash still leaves every completed result on disk
+            out.write(orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS) + b"\n")
+            out.flush()
+
+    async def iter_diagnostic(self, models_to_test: List[str] = None,
+                              available_models: List[str] = None):
+        """Run the suite, yielding each result as an event dict as soon as it completes
+        
+        Results are also collected in self.results for the summary and report, so
+        concurrent callers must hold run_lock around the whole iteration.
+        """
+        if models_to_test is None:
+            models_to_test = list(DEFAULT_MODELS)
+        
+        self.results = []
+        self._models_body = None
+        self.http_client.retry_counts.clear()
         
-        # Test 3: Model Availability
+        # Test 1: API Connectivity
+        yield self._record(await self.test_api_connectivity_async())
+        
+        # Tests 2-3: Rate Limits and Model Availability are independent, so overlap them
+        # and report whichever finishes first
         if self.results[-1].status != "FAIL":
-            model_results = self.test_model_availability(models_to_test)
-            for result in model_results:
-                self.add_result(result)
+            if available_models is None:
+                available_models = await self._live_catalog()
+            
+            for next_done in asyncio.as_completed([
+                self.test_rate_limits_async(models_to_test[0]),
+                self.test_model_availability_async(models_to_test, available_models)
+            ]):
+                done = await next_done
+                for result in (done if isinstance(done, list) else [done]):
+                    yield self._record(result)
         
         # Test 4: Performance Test (only if basic tests pass)
         working_models = [r.details.get('model') for r in self.results 
                          if r.test_name.startswith('Model:') and r.status == 'PASS']
         
         if working_models:
-            self.add_result(self.test_inference_performance(working_models[0]))
+            yield self._record(await self.test_inference_performance_async(working_models[0]))
         
         # Test 5: Billing Status
-        self.add_result(self.test_billing_status())
+        yield self._record(self.test_billing_status())
         
         # Test 6: Error Patterns
         if working_models:
-            self.add_result(self.test_error_patterns(working_models[0]))
+            yield self._record(await self.test_error_patterns_async(working_models[0]))
+
+    async def _live_catalog(self) -> Optional[set]:
+        """Model ids from the /v1/models body connectivity just downloaded, else the local copy"""
+        if self._models_body is not None:
+            try:
+                ids = _model_ids(orjson.loads(self._models_body))
+            except (orjson.JSONDecodeError, TypeError):
+                pass
+            else:
+                # The live catalog was fetched anyway, so it refreshes the local copy for free
+                self._store_catalog(ids)
+                return ids
         
-        # Generate summary
+        # No usable live body: the local copy, revalidated against /v1/models once stale
+        catalog = await self.load_models_catalog_async()
+        return set(catalog) if catalog is not None else None
+
+    def _record(self, result: DiagnosticResult) -> Dict:
+        """Add a result and return it as a streamable event"""
+        self.add_result(result)
+        return self._result_event(result)
+
+    @staticmethod
+    def _result_event(result: DiagnosticResult) -> Dict:
+        return {
+            "test": result.test_name,
+            "status": result.status,
+            "message": result.message,
+            "details": result.details,
+            "recommendation": result.recommendation
+        }
+
+    def _build_report(self) -> Dict:
+        """Print the summary of the collected results and assemble the full report"""
         summary = self.generate_summary()
         print("\n" + "="*50)
         print("DIAGNOSTIC SUMMARY")
@@ -637,208 +1596,219 @@ class TogetherAITroubleshooter:
         
         return {
             "timestamp": datetime.now().isoformat(),
-            "results": [
-                {
-                    "test": r.test_name,
-                    "status": r.status,
-                    "message": r.message,
-                    "details": r.details,
-                    "recommendation": r.recommendation
-                }
-                for r in self.results
-            ],
-            "summary": summary
+            "results": [self._result_event(r) for r in self.results],
+            "summary": summary,
+            # Transient failures smoothed over by retries, per probe
+            "retries": dict(self.http_client.retry_counts)
         }
 
     def generate_summary(self) -> str:
         """Generate a summary of all diagnostic results"""
         total_tests = len(self.results)
-        passed = len([r for r in self.results if r.status == "PASS"])
-        failed = len([r for r in self.results if r.status == "FAIL"])
-        warnings = len([r for r in self.results if r.status == "WARNING"])
+        status_counts = Counter(r.status for r in self.results)
+        passed = status_counts["PASS"]
+        failed = status_counts["FAIL"]
+        warnings = status_counts["WARNING"]
         
-        summary = f"""
+        parts = [f"""
 Test Results: {passed} PASSED, {failed} FAILED, {warnings} WARNINGS out of {total_tests} total tests
 
 Critical Issues:
-"""
+"""]
         
         critical_issues = [r for r in self.results if r.status == "FAIL"]
         if critical_issues:
             for issue in critical_issues:
-                summary += f"• {issue.test_name}: {issue.message}\n"
+                parts.append(f"• {issue.test_name}: {issue.message}\n")
                 if issue.recommendation:
-                    summary += f"  Action: {issue.recommendation}\n"
+                    parts.append(f"  Action: {issue.recommendation}\n")
         else:
-            summary += "• None detected\n"
+            parts.append("• None detected\n")
         
-        summary += "\nRecommended Actions:\n"
+        parts.append("\nRecommended Actions:\n")
         
         # Provide specific troubleshooting advice based on results
         if any(r.test_name == "API Connectivity" and r.status == "FAIL" for r in self.results):
-            summary += "• Check your internet connection and API key\n"
-            summary += "• Visit status.together.ai to check service status\n"
+            parts.append("• Check your internet connection and API key\n")
+            parts.append("• Visit status.together.ai to check service status\n")
         
         if any("429" in r.message for r in self.results):
-            summary += "• Implement rate limiting in your application\n"
-            summary += "• Consider requesting higher rate limits\n"
-            summary += "• Use exponential backoff for retries\n"
+            parts.append("• Implement rate limiting in your application\n")
+            parts.append("• Consider requesting higher rate limits\n")
+            parts.append("• Use exponential backoff for retries\n")
         
         if any(r.test_name.startswith("Model:") and r.status == "FAIL" for r in self.results):
-            summary += "• Verify model names using the /models endpoint\n"
-            summary += "• Check if models require special access or billing tier\n"
+            parts.append("• Verify model names using the /models endpoint\n")
+            parts.append("• Check if models require special access or billing tier\n")
         
         performance_results = [r for r in self.results if r.test_name == "Inference Performance"]
         if performance_results and performance_results[0].status in ["WARNING", "FAIL"]:
-            summary += "• Consider using smaller or faster models\n"
-            summary += "• Check if you're on a busy tier - consider upgrading\n"
+            parts.append("• Consider using smaller or faster models\n")
+            parts.append("• Check if you're on a busy tier - consider upgrading\n")
         
-        return summary
+        return "".join(parts)
 
     def diagnose_customer_issue(self, customer_report: str) -> str:
         """Diagnose specific customer-reported issues"""
-        customer_report = customer_report.lower()
-        
-        if "503" in customer_report:
-            return """
-503 Service Unavailable - Possible Causes:
-• Together AI servers are temporarily overloaded
-• Scheduled maintenance or capacity issues
-• Regional outages or network problems
+        return _ISSUE_ADVICE[_classify(_normalize_report(customer_report))]
 
-Recommended Actions:
-1. Check status.together.ai for known issues
-2. Implement retry logic with exponential backoff
-3. Consider switching to dedicated instances for guaranteed capacity
-4. If persistent, contact Together AI support
-"""
-        
-        elif "429" in customer_report or "rate limit" in customer_report:
-            return """
-429 Rate Limit Exceeded - Possible Causes:
-• Exceeding requests per second (RPS) limits
-• Exceeding tokens per second (TPS) limits  
-• Burst traffic patterns overwhelming limits
 
-Recommended Actions:
-1. Implement request queuing and rate limiting
-2. Use exponential backoff for retries
-3. Monitor rate limit headers in responses
-4. Request higher limits at together.ai/forms/rate-limit-increase
-5. Consider upgrading to Scale or Enterprise tiers
-"""
-        
-        elif "401" in customer_report or "authentication" in customer_report:
-            return """
-401 Authentication Failed - Possible Causes:
-• Invalid or expired API key
-• API key not included in Authorization header
-• Incorrect header format
+def resolve_api_key(cli_key: str = None) -> Optional[str]:
+    """API key from the CLI or environment, prompting only when attached to a terminal"""
+    api_key = cli_key or os.getenv('TOGETHERAI_API_KEY') or os.getenv('TOGETHER_AI_API_KEY')
+    if not api_key and sys.stdin.isatty():
+        api_key = input("Enter your Together AI API key: ").strip()
+    return api_key or None
 
-Recommended Actions:
-1. Verify API key at api.together.ai Settings > API Keys
-2. Ensure header format: "Authorization: Bearer YOUR_API_KEY"
-3. Regenerate API key if compromised
-4. Check if API key has required permissions
-"""
-        
-        elif "400" in customer_report or "bad request" in customer_report:
-            return """
-400 Bad Request - Possible Causes:
-• Invalid request format or parameters
-• Missing required fields (model, prompt)
-• Invalid model name or unavailable model
-• Excessive max_tokens parameter
 
-Recommended Actions:
-1. Validate request payload against API documentation
-2. Check model name using /models endpoint
-3. Ensure max_tokens is within model limits
-4. Verify all required fields are present
-"""
-        
-        elif "timeout" in customer_report or "slow" in customer_report:
-            return """
-Timeout/Slow Response Issues - Possible Causes:
-• Large models taking longer to generate responses
-• High system load during peak hours
-• Complex prompts requiring more processing
-• Network latency issues
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Command line options; anything left unset falls back to the environment"""
+    parser = argparse.ArgumentParser(description="Diagnose Together AI inference issues")
+    parser.add_argument('--api-key', help="Together AI API key (default: TOGETHER_AI_API_KEY)")
+    parser.add_argument('--models', help="Comma-separated models to test (default: built-in list)")
+    parser.add_argument('--config', help="JSON file of troubleshooter config overrides")
+    parser.add_argument('--iterations', type=int, help="Performance test requests")
+    parser.add_argument('--concurrent', type=int, help="Maximum concurrent requests")
+    parser.add_argument('--cache-policy', choices=DiagnosticCache.POLICIES, help="Diagnostic cache policy")
+    parser.add_argument('--no-remote', action='store_true', help="Check models against the local catalog, not the live one")
+    parser.add_argument('--compare-last', type=int, metavar='N',
+                        help="Compare test statuses across the last N runs with the same models and config")
+    parser.add_argument('--output', help="Also write the report to this JSON file")
+    parser.add_argument('--ndjson', metavar='PATH',
+                        help="Run live and append each result to this NDJSON file as it completes")
+    parser.add_argument('--cache-stats', action='store_true',
+                        help="Print hit/miss counts of the customer issue classifier cache on exit")
+    return parser.parse_args(argv)
 
-Recommended Actions:
-1. Increase client timeout values
-2. Use smaller/faster models for time-critical applications
-3. Implement async processing for long requests
-4. Consider dedicated instances for consistent performance
-5. Optimize prompts to be more specific and concise
-"""
-        
-        else:
-            return """
-General Troubleshooting Steps:
-1. Run full diagnostic using this tool
-2. Check Together AI status page
-3. Verify API key and permissions
-4. Test with different models and simple prompts
-5. Implement proper error handling and retries
-6. Monitor rate limits and usage patterns
-7. Contact Together AI support with specific error details
-"""
+
+def compare_runs(runs: List[Dict]) -> str:
+    """Per-test statuses across runs, oldest first; '*' marks tests whose status changed"""
+    statuses = [{r['test']: r['status'] for r in run['results']} for run in runs]
+    tests = dict.fromkeys(name for run_statuses in statuses for name in run_statuses)
+    
+    lines = ["Runs: " + " -> ".join(run['timestamp'][:19] for run in runs)]
+    for test in tests:
+        row = [run_statuses.get(test, "-") for run_statuses in statuses]
+        marker = "*" if len(set(row)) > 1 else " "
+        lines.append(f"{marker} {test}: {' -> '.join(row)}")
+    return "\n".join(lines)
 
 
-def main():
+def main(argv: List[str] = None) -> int:
     """Example usage of the troubleshooting tool"""
+    args = parse_args(argv)
+    interactive = sys.stdin.isatty()
     
-    # Get API key from user or environment
-    api_key = os.getenv('TOGETHERAI_API_KEY') or os.getenv('TOGETHER_AI_API_KEY') or input("Enter your Together AI API key: ").strip()
+    # Get API key from the command line, environment or (interactively) the user
+    api_key = resolve_api_key(args.api_key)
     
     if not api_key:
-        print("API key is required to run diagnostics")
-        print("Set TOGETHER_AI_API_KEY environment variable or enter it manually")
-        return
-    
-    # Load configuration from environment or use defaults
-    config = {
-        'log_level': os.getenv('TOGETHER_AI_LOG_LEVEL', 'INFO'),
-        'timeout': int(os.getenv('TOGETHER_AI_TIMEOUT', '30')),
-        'performance_test_iterations': int(os.getenv('TOGETHER_AI_PERF_TESTS', '3')),
-        'concurrent_test_requests': int(os.getenv('TOGETHER_AI_CONCURRENT', '5'))
-    }
-    
-    # Initialize troubleshooter with configuration
-    troubleshooter = TogetherAITroubleshooter(api_key, config=config)
-    
-    # Get models to test
-    models_input = input("Enter models to test (comma-separated, or press Enter for defaults): ").strip()
-    
-    if models_input:
-        models_to_test = [model.strip() for model in models_input.split(",")]
-    else:
-        models_to_test = None
+        print("API key is required to run diagnostics", file=sys.stderr)
+        print("Pass --api-key or set the TOGETHER_AI_API_KEY environment variable", file=sys.stderr)
+        return 2
     
-    # Run diagnostics
-    results = troubleshooter.run_full_diagnostic(models_to_test)
-    
-    # Save results to file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"together_ai_diagnostic_{timestamp}.json"
+    # A config file overrides the environment, and explicit flags override both
+    overrides = {}
+    try:
+        if args.config:
+            with open(args.config, 'rb') as f:
+                loaded = orjson.loads(f.read())
+            if not isinstance(loaded, dict):
+                raise ValueError(f"{args.config} must hold a JSON object, got {type(loaded).__name__}")
+            overrides.update(loaded)
+        if args.iterations is not None:
+            overrides['performance_test_iterations'] = args.iterations
+        if args.concurrent is not None:
+            overrides['concurrent_test_requests'] = args.concurrent
+        if args.cache_policy:
+            overrides['cache_policy'] = args.cache_policy
+        
+        config = Config.from_env(**overrides)
+    except (OSError, ValueError) as e:  # orjson.JSONDecodeError is a ValueError
+        print(f"Invalid configuration: {e}", file=sys.stderr)
+        return 2
     
-    with open(filename, 'w') as f:
-        json.dump(results, f, indent=2)
+    # Initialize troubleshooter with configuration; leaving the block closes its HTTP session
+    with TogetherAITroubleshooter(api_key, config=config) as troubleshooter:
+        # Get models to test
+        if args.models is not None:
+            models_input = args.models
+        elif interactive:
+            models_input = input("Enter models to test (comma-separated, or press Enter for defaults): ").strip()
+        else:
+            models_input = ""
+        
+        if models_input:
+            models_to_test = [model.strip() for model in models_input.split(",") if model.strip()]
+            if not models_to_test:
+                print(f"No model names in {models_input!r}; pass comma-separated model ids", file=sys.stderr)
+                return 2
+        else:
+            models_to_test = list(DEFAULT_MODELS)
+        
+        # Availability is judged against the live catalog the connectivity probe downloads;
+        # a local catalog is only passed when the run is pinned to one (air-gapped, --no-remote)
+        disable_remote = args.no_remote or os.getenv('TOGETHER_AI_DISABLE_REMOTE', '').lower() in ('1', 'true', 'yes')
+        available_models = None
+        if disable_remote or os.getenv('TOGETHER_AI_MODELS_PATH'):
+            try:
+                available_models = troubleshooter.load_models_catalog(disable_remote=True)
+            except CatalogUnavailableError as e:
+                # An air-gapped run must not quietly fall back to the live catalog
+                print(e, file=sys.stderr)
+                return 2
+            if available_models is None:
+                print("No local model catalog yet; checking models against the live one", file=sys.stderr)
+        
+        # Run diagnostics, streaming results out as they land when asked to
+        try:
+            if args.ndjson:
+                with open(args.ndjson, 'ab') as f:
+                    results = troubleshooter.stream_diagnostic(f, models_to_test, available_models)
+            else:
+                results = troubleshooter.run_full_diagnostic(models_to_test, available_models)
+        except CacheMissError as e:
+            print(f"{e} - rerun with --cache-policy enabled to capture one", file=sys.stderr)
+            return 1
+        
+        cache_key = DiagnosticCache.key(api_key, troubleshooter.base_url, models_to_test, troubleshooter.config)
+        
+    # Record results in the history database, indexed by diagnostic for later comparison
+    with DiagnosticHistory(compress=config.compress) as history:
+        history.record(api_key, models_to_test, results, cache_key)
+        print(f"\nDetailed results recorded in: {history.path}")
+        
+        if args.compare_last:
+            print("\n" + "="*50)
+            print(f"LAST {args.compare_last} RUNS")
+            print("="*50)
+            print(compare_runs(history.last(cache_key, args.compare_last)))
     
-    print(f"\nDetailed results saved to: {filename}")
+    if args.output:
+        # Header-derived details are keyed by aiohttp's istr, a str subclass
+        data = orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        with open(args.output, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=3) if args.output.endswith('.gz') else data)
+        print(f"Detailed results saved to: {args.output}")
     
-    # Example customer issue diagnosis
-    print("\n" + "="*50)
-    print("CUSTOMER ISSUE DIAGNOSIS")
-    print("="*50)
+    # Example customer issue diagnosis, only when someone is there to describe one
+    if interactive:
+        print("\n" + "="*50)
+        print("CUSTOMER ISSUE DIAGNOSIS")
+        print("="*50)
+        
+        issue_report = input("Describe customer issue (or press Enter to skip): ").strip()
+        
+        if issue_report:
+            diagnosis = troubleshooter.diagnose_customer_issue(issue_report)
+            print(diagnosis)
     
-    issue_report = input("Describe customer issue (or press Enter to skip): ").strip()
+    if args.cache_stats:
+        # Shows whether the classifier's maxsize fits the ticket stream
+        print(f"Issue classifier cache: {_classify.cache_info()}")
     
-    if issue_report:
-        diagnosis = troubleshooter.diagnose_customer_issue(issue_report)
-        print(diagnosis)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
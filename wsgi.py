@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for serving the API proxy under gunicorn with gevent workers
+"""
+
+# Patch sockets before requests/urllib3 are imported so upstream waits yield to other greenlets
+from gevent import monkey
+monkey.patch_all()
+
+from api_proxy import app  # noqa: E402